@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+# Statistical validation of fast (alias table) update mode.
+# Fast mode makes different random choices than the reference synchronous mode,
+# and so the comparison is between population distributions over many seeds:
+# Run exact mode with two disjoint sets of seeds to measure sampling noise,
+# and fast mode with a third disjoint set, and check that fast mode differs from exact
+# mode by no more than exact mode differs from itself.  Fast mode can't share seeds
+# with exact mode, since shared random numbers would bias the distance low.
+
+import sys
+import os
+import getopt
+
+import rutil
+import gengraph
+import sim
+
+def usage(name):
+    print "Usage: %s [-h] -g GFILE -r RFILE [-n STEPS] [-k SEEDS] [-x TOL]" % name
+    print "    -h        Print this message"
+    print "    -g GFILE  Graph file"
+    print "    -r RFILE  Initial rat position file"
+    print "    -n STEPS  Number of simulation steps (default = %d)" % defaultSteps
+    print "    -k SEEDS  Number of seeds per sample (default = %d)" % defaultSeeds
+    print "    -x TOL    Accept if fast mode distance <= TOL * sampling noise (default = %.2f)" % defaultTolerance
+    sys.exit(0)
+
+defaultSteps = 20
+defaultSeeds = 10
+defaultTolerance = 1.5
+
+# Run simulation, returning list of population lists, one for each step
+def runTrace(g, rfname, seed, update, stepCount):
+    nullFile = open(os.devnull, "w")
+    savedErr = sys.stderr
+    sys.stderr = nullFile
+    s = sim.Simulator(g, outFile = nullFile)
+    ok = s.loadRats(rfname, seed)
+    sys.stderr = savedErr
+    if not ok:
+        return None
+    s.updateMode = update
+    bsize = s.updateBatchSize(update)
+    trace = []
+    for step in xrange(stepCount):
+        s.runStep(bsize)
+        trace.append(s.populationList())
+    return trace
+
+# For each step, compute mean count of each node over set of traces
+def meanCounts(traces):
+    k = float(len(traces))
+    result = []
+    for step in range(len(traces[0])):
+        pops = [t[step] for t in traces]
+        result.append([sum(vals)/k for vals in zip(*pops)])
+    return result
+
+# For each step, compute normalized histogram of node counts, pooled over traces
+def countHistograms(traces):
+    result = []
+    for step in range(len(traces[0])):
+        hist = {}
+        total = 0
+        for t in traces:
+            for c in t[step]:
+                hist[c] = hist.get(c, 0) + 1
+                total += 1
+        result.append(dict([(c, float(v)/total) for (c, v) in hist.items()]))
+    return result
+
+# L1 distance between mean count vectors, normalized by number of rats
+def meanDistance(ma, mb, rcount):
+    return sum([abs(a-b) for (a, b) in zip(ma, mb)]) / rcount
+
+# Total variation distance between histograms
+def histDistance(ha, hb):
+    keys = set(ha.keys()) | set(hb.keys())
+    return 0.5 * sum([abs(ha.get(c, 0.0) - hb.get(c, 0.0)) for c in keys])
+
+def run(name, args):
+    gfname = ""
+    rfname = ""
+    stepCount = defaultSteps
+    seedCount = defaultSeeds
+    tolerance = defaultTolerance
+    optlist, args = getopt.getopt(args, "hg:r:n:k:x:")
+    for (opt, val) in optlist:
+        if opt == '-h':
+            usage(name)
+        elif opt == '-g':
+            gfname = val
+        elif opt == '-r':
+            rfname = val
+        elif opt == '-n':
+            stepCount = int(val)
+        elif opt == '-k':
+            seedCount = int(val)
+        elif opt == '-x':
+            tolerance = float(val)
+    if gfname == "" or rfname == "":
+        print "Error.  Need graph file and rat file"
+        usage(name)
+    g = gengraph.Graph()
+    if not g.load(gfname):
+        return False
+    seeds = [rutil.DEFAULTSEED + i for i in range(3 * seedCount)]
+    exactA = [runTrace(g, rfname, seed, sim.UpdateMode.synchronous, stepCount) for seed in seeds[:seedCount]]
+    exactB = [runTrace(g, rfname, seed, sim.UpdateMode.synchronous, stepCount) for seed in seeds[seedCount:2*seedCount]]
+    fast = [runTrace(g, rfname, seed, sim.UpdateMode.fast, stepCount) for seed in seeds[2*seedCount:]]
+    if None in exactA + exactB + fast:
+        print "Error.  Couldn't load rats from '%s'" % rfname
+        return False
+    rcount = float(sum(exactA[0][0]))
+    meanA, meanB, meanF = meanCounts(exactA), meanCounts(exactB), meanCounts(fast)
+    histA, histB, histF = countHistograms(exactA), countHistograms(exactB), countHistograms(fast)
+    print "\tstep\tL1(noise)\tL1(fast)\tTV(noise)\tTV(fast)"
+    print "\t" + "---------" * 8
+    sums = [0.0] * 4
+    for step in range(stepCount):
+        vals = [meanDistance(meanA[step], meanB[step], rcount),
+                meanDistance(meanA[step], meanF[step], rcount),
+                histDistance(histA[step], histB[step]),
+                histDistance(histA[step], histF[step])]
+        sums = [s + v for (s, v) in zip(sums, vals)]
+        print "\t%d\t" % (step+1) + "\t".join(["%.4f\t" % v for v in vals])
+    avgs = [s / stepCount for s in sums]
+    print "\tavg\t" + "\t".join(["%.4f\t" % v for v in avgs])
+    ok = avgs[1] <= tolerance * avgs[0] and avgs[3] <= tolerance * avgs[2]
+    print "Fast mode %s (tolerance = %.2f)" % ("CONSISTENT with exact mode" if ok else "DIFFERS from exact mode", tolerance)
+    return ok
+
+if __name__ == "__main__":
+    if not run(sys.argv[0], sys.argv[1:]):
+        sys.exit(1)
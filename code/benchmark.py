@@ -8,12 +8,15 @@ import getopt
 import math
 import datetime
 import random
+import multiprocessing
 
 import grade
+import streamio
+import datagen
 
 def usage(fname):
     
-    ustring = "Usage: %s [-h] [-s SCALE] [-u UPDATELIST] [-t THREADLIMIT] [-f OUTFILE] [-c]" % fname
+    ustring = "Usage: %s [-h] [-s SCALE] [-u UPDATELIST] [-t THREADLIMIT] [-f OUTFILE] [-c] [-S] [-k SIZES] [-g GTYPES] [-r RTYPE] [-P POLICIES] [-a CPUS]" % fname
     print ustring
     print "(All lists given as colon-separated text.)"
     print "    -h            Print this message"
@@ -27,6 +30,18 @@ def usage(fname):
     print "    -f OUTFILE    Create output file recording measurements"
     print "         If file name contains field of form XX..X, will replace with ID having that many digits"
     print "    -c            Compare simulator output to recorded result"
+    print "    Missing graph and rat files are generated concurrently and cached in %s" % (dataDir + datagen.cacheSubdirectory)
+    print "    -S            Scaling study.  For each update mode, graph type, and graph size,"
+    print "         run with thread counts 1, 2, 4, ... up to number of cores (%d) or THREADLIMIT." % multiprocessing.cpu_count()
+    print "         Report speedup and efficiency, and fit serial fraction (Amdahl's Law)"
+    print "    -k SIZES      Graph sizes for scaling study (default = %s)" % ":".join(map(str, scalingSizeList))
+    print "    -g GTYPES     Graph types for scaling study (default = %s)" % ":".join(scalingTypeList)
+    print "    -r RTYPE      Rat distribution for scaling study (default = %s)" % scalingRatType
+    print "    -P POLICIES   Thread placement policies.  Each configuration is run under every policy (default = none)"
+    for p in Placement.names:
+        print "       %s: %s" % (p, Placement.descriptions[Placement().parse(p)])
+    print "    -a CPUS       Restrict pinned placement to CPUs, given as list of ranges, e.g., 0-7,16-23"
+    print "       Can't be combined with placement policy none"
     sys.exit(0)
 
 # Enumerated type for update mode:
@@ -36,6 +51,22 @@ class UpdateMode:
     ratOrder, batch, synchronous = range(3)
     flags = ['r', 'b', 's']
 
+# Thread placement policy.
+# Pinned policies run each simulation with taskset, restricted to one CPU per thread,
+# and set OMP_PROC_BIND and OMP_PLACES so that each OMP thread is bound to one of those CPUs.
+# Physical cores are used before their hyperthread siblings
+class Placement:
+    none, close, spread = range(3)
+    names = ["none", "close", "spread"]
+    descriptions = ["Leave placement to OS and OMP runtime",
+                    "Pin to consecutive cores, filling one socket before the next",
+                    "Pin to cores taken from each socket in turn"]
+
+    def parse(self, name):
+        if name in self.names:
+            return self.names.index(name)
+        return -1
+
 # General information
 simProg = "./crun"
 ompSimProg = "./crun-omp"
@@ -51,6 +82,11 @@ mismatchLimit = 5
 # Dictionary of geometric means, indexed by (mode, threads)
 gmeanDict = {}
 
+# CPUs available for placement: List of (cpu, socket, core)
+topology = []
+# Path of taskset program.  None if not found
+tasksetProg = None
+
 
 
 def outmsg(s, noreturn = False):
@@ -97,16 +133,29 @@ benchmarkList = [
 synchRunList = [(1, 800), (12, 800)]
 otherRunList = [(1, 400), (12, 400)]
 
+# Scaling study
+scalingSizeList = [1024, 10000, 102400]
+scalingTypeList = ['t', 'f']
+scalingRatType = 'u'
+scalingSteps = 100
+
 def captureFileName(graphSize, graphType, ratType, loadFactor, stepCount, updateFlag):
     params = (graphSize, graphType, ratType, loadFactor, stepCount, updateFlag)
     return captureDirectory + "/cap" + "-%.3d-%s-%s-%.3d-%.3d-%s.txt" % params
 
+# Captured results may be stored compressed
+captureExtensions = ["", ".gz", ".bz2", ".xz"]
+
 def openCaptureFile(graphSize, graphType, ratType, loadFactor, stepCount, updateFlag):
     if not doCheck:
         return None
     name = captureFileName(graphSize, graphType, ratType, loadFactor, stepCount, updateFlag)
+    for ext in captureExtensions:
+        if os.path.exists(name + ext):
+            name += ext
+            break
     try:
-        cfile = open(name, "r")
+        cfile = streamio.openInput(name)
     except Exception as e:
         outmsg("Couldn't open captured result file '%s': %s" % (name, e))
         return None
@@ -148,16 +197,16 @@ def checkOutputs(captureFile, outputFile):
         outmsg("Simulator output matches recorded results!")
     return badLines == 0
 
-def cmd(graphSize, graphType, ratType, loadFactor, stepCount, updateType, threadCount, otherArgs):
+def cmd(graphSize, graphType, ratType, loadFactor, stepCount, updateType, threadCount, placement, otherArgs):
     global bcount, logSum
     global cacheKey
     updateFlag = UpdateMode.flags[updateType]
     params = ["%5d" % graphSize, graphType, "%4d" % loadFactor, ratType, str(stepCount), updateFlag]
-    cacheKey = ":".join(params)
-    results = params + [str(threadCount)]
-    sizeName = str(graphSize)
-    graphFileName = dataDir + "g-" + graphType + sizeName + ".gph"
-    ratFileName = dataDir + "r-" + sizeName + '-' + ratType + str(loadFactor) + ".rats"
+    # Speedup is relative to single-threaded run with same placement
+    cacheKey = ":".join(params + [Placement.names[placement]])
+    results = params + [str(threadCount), Placement.names[placement]]
+    graphFileName = datagen.graphPath(dataDir, graphSize, graphType)
+    ratFileName = datagen.ratPath(dataDir, graphSize, ratType, loadFactor)
     checkFile = openCaptureFile(graphSize, graphType, ratType, loadFactor, stepCount, updateFlag)
     recordOutput = checkFile is not None
     ok = True
@@ -166,7 +215,8 @@ def cmd(graphSize, graphType, ratType, loadFactor, stepCount, updateType, thread
     else:
         clist = runFlags + ["-g", graphFileName, "-r", ratFileName, "-u", updateFlag, "-n", str(stepCount), "-i", str(stepCount)] + otherArgs
     prog = simProg if threadCount == 1 else ompSimProg
-    gcmd = [prog] + clist + ["-t", str(threadCount)]
+    prefix, env = placementSetup(placement, threadCount)
+    gcmd = prefix + [prog] + clist + ["-t", str(threadCount)]
     gcmdLine = " ".join(gcmd)
     retcode = 1
     tstart = datetime.datetime.now()
@@ -174,13 +224,13 @@ def cmd(graphSize, graphType, ratType, loadFactor, stepCount, updateType, thread
         # File number of standard output
         stdoutFileNumber = 1
         if recordOutput:
-            simProcess = subprocess.Popen(gcmd, stderr = subprocess.PIPE, stdout = subprocess.PIPE)
+            simProcess = subprocess.Popen(gcmd, stderr = subprocess.PIPE, stdout = subprocess.PIPE, env = env)
             ok = ok and checkOutputs(checkFile, simProcess.stdout)
             # Echo any results printed by simulator on stderr onto stdout
             for line in simProcess.stderr:
                 sys.stdout.write(line)
         else:
-            simProcess = subprocess.Popen(gcmd, stderr = stdoutFileNumber)
+            simProcess = subprocess.Popen(gcmd, stderr = stdoutFileNumber, env = env)
 
         simProcess.wait()
         retcode = simProcess.returncode
@@ -212,28 +262,266 @@ def cmd(graphSize, graphType, ratType, loadFactor, stepCount, updateType, thread
         return False
     return ok
 
-def sweep(updateType, threadLimit, scale, otherArgs):
+# Grading uses measurements with first placement policy
+def sweep(updateType, threadLimit, scale, placementList, otherArgs):
     runList = synchRunList if updateType == UpdateMode.synchronous else otherRunList
     ok = True
     for rparams in runList:
-        reset()
         (threadCount, stepCount) = rparams
         stepCount = stepCount / scale
         if threadCount > threadLimit:
             continue
-        outmsg("\tNodes\tgtype\tlf\trtype\tsteps\tupdate\tthreads\tsecs\tMRPS")
-        outmsg(nomarker + "---------" * 8)
-        for bparams in benchmarkList:
-            (graphSize, graphType, ratType, loadFactor) = bparams
-            ok = ok and cmd(graphSize, graphType, ratType, loadFactor, stepCount, updateType, threadCount, otherArgs)
-        if bcount > 0:
-            gmean = math.exp(logSum/bcount)
-            updateFlag = UpdateMode.flags[updateType]
-            outmsg(marker + "Gmean\t\t\t\t\t%s\t%d\t\t%7.2f" % (updateFlag, threadCount, gmean))
-            outmsg(marker + "---------" * 8)
-            gmeanDict[(updateFlag, threadCount)] = gmean
+        for placement in placementList:
+            reset()
+            outmsg("\tNodes\tgtype\tlf\trtype\tsteps\tupdate\tthreads\tplace\tsecs\tMRPS")
+            outmsg(nomarker + "---------" * 9)
+            for bparams in benchmarkList:
+                (graphSize, graphType, ratType, loadFactor) = bparams
+                ok = ok and cmd(graphSize, graphType, ratType, loadFactor, stepCount, updateType, threadCount, placement, otherArgs)
+            if bcount > 0:
+                gmean = math.exp(logSum/bcount)
+                updateFlag = UpdateMode.flags[updateType]
+                outmsg(marker + "Gmean\t\t\t\t\t%s\t%d\t%s\t\t%7.2f" % (updateFlag, threadCount, Placement.names[placement], gmean))
+                outmsg(marker + "---------" * 9)
+                if placement == placementList[0]:
+                    gmeanDict[(updateFlag, threadCount)] = gmean
     return ok
 
+# Run simulator without checking output.  Returns elapsed seconds, or None if failed
+def timeRun(graphFileName, ratFileName, stepCount, updateType, threadCount, placement = Placement.none):
+    updateFlag = UpdateMode.flags[updateType]
+    prog = simProg if threadCount == 1 else ompSimProg
+    prefix, env = placementSetup(placement, threadCount)
+    gcmd = prefix + [prog] + runFlags + ["-g", graphFileName, "-r", ratFileName, "-u", updateFlag,
+                                "-n", str(stepCount), "-i", str(stepCount), "-t", str(threadCount)]
+    gcmdLine = " ".join(gcmd)
+    tstart = datetime.datetime.now()
+    try:
+        simProcess = subprocess.Popen(gcmd, stdout = open(os.devnull, "w"), stderr = subprocess.PIPE, env = env)
+        simProcess.communicate()
+        retcode = simProcess.returncode
+    except Exception as e:
+        print "Execution of command '%s' failed. %s" % (gcmdLine, e)
+        return None
+    if retcode != 0:
+        print "Execution of command '%s' gave return code %d" % (gcmdLine, retcode)
+        return None
+    delta = datetime.datetime.now() - tstart
+    return delta.seconds + 24 * 3600 * delta.days + 1e-6 * delta.microseconds
+
+# Thread counts for scaling study: Powers of two, plus upper limit
+def scalingThreads(threadLimit):
+    limit = min(threadLimit, multiprocessing.cpu_count())
+    tlist = []
+    t = 1
+    while t < limit:
+        tlist.append(t)
+        t *= 2
+    tlist.append(max(limit, 1))
+    return tlist
+
+# Fit serial fraction f to list of (threads, speedup) pairs according to Amdahl's Law:
+# 1/S = f + (1-f)/p, and so 1/S - 1/p = f * (1 - 1/p).  Least squares fit.
+# Returns None when no data from parallel runs
+def amdahlFit(points):
+    sxx = 0.0
+    sxy = 0.0
+    for (p, s) in points:
+        x = 1.0 - 1.0/p
+        y = 1.0/s - 1.0/p
+        sxx += x * x
+        sxy += x * y
+    if sxx == 0.0:
+        return None
+    return min(max(sxy / sxx, 0.0), 1.0)
+
+def amdahlString(f):
+    if f is None:
+        return "serial fraction\t---"
+    limit = "%7.2fX" % (1.0/f) if f > 0 else "unbounded"
+    return "serial fraction\t%.4f\tspeedup limit\t%s" % (f, limit)
+
+# Scaling study for single update mode.  Speedups are relative to single-threaded run with same placement
+def scalingSweep(updateType, sizeList, typeList, ratType, threadLimit, scale, placementList = [Placement.none]):
+    updateFlag = UpdateMode.flags[updateType]
+    stepCount = max(int(scalingSteps / scale), 1)
+    threadList = scalingThreads(threadLimit)
+    ok = True
+    for graphType in typeList:
+        for placement in placementList:
+            place = Placement.names[placement]
+            outmsg("\tNodes\tgtype\tlf\trtype\tsteps\tupdate\tthreads\tplace\tsecs\tMRPS\tspeedup\tefficiency")
+            outmsg(nomarker + "---------" * 11)
+            typePoints = []
+            for graphSize in sizeList:
+                loadFactor = datagen.loadFactor(graphSize)
+                graphFileName = datagen.graphPath(dataDir, graphSize, graphType)
+                ratFileName = datagen.ratPath(dataDir, graphSize, ratType, loadFactor)
+                if not os.path.exists(graphFileName) or not os.path.exists(ratFileName):
+                    outmsg("Couldn't get input files for graph size %d, type %s" % (graphSize, graphType))
+                    ok = False
+                    continue
+                rops = graphSize * loadFactor * stepCount
+                baseSecs = None
+                sizePoints = []
+                for threadCount in threadList:
+                    secs = timeRun(graphFileName, ratFileName, stepCount, updateType, threadCount, placement)
+                    if secs is None:
+                        ok = False
+                        continue
+                    if threadCount == 1:
+                        baseSecs = secs
+                    mrps = 1e-6 * float(rops)/secs
+                    results = ["%5d" % graphSize, graphType, "%4d" % loadFactor, ratType, str(stepCount), updateFlag,
+                               str(threadCount), place, "%.2f" % secs, "%7.2f" % mrps]
+                    if baseSecs is not None:
+                        speedup = baseSecs / secs
+                        results += ["%5.2fX" % speedup, "%5.1f%%" % (100.0 * speedup / threadCount)]
+                        sizePoints.append((threadCount, speedup))
+                    outmsg(marker + "\t".join(results))
+                outmsg(marker + "Amdahl\t%5d\t%s\t\t\t%s\t\t%s\t%s" % (graphSize, graphType, updateFlag, place, amdahlString(amdahlFit(sizePoints))))
+                typePoints += sizePoints
+            outmsg(marker + "Amdahl\tall\t%s\t\t\t%s\t\t%s\t%s" % (graphType, updateFlag, place, amdahlString(amdahlFit(typePoints))))
+            outmsg(marker + "---------" * 11)
+    return ok
+
+# Parse list of CPU ranges, e.g., "0-3,8".  Returns None if invalid
+def parseCpuList(val):
+    cpus = []
+    try:
+        for field in val.split(','):
+            if field.strip() == "":
+                continue
+            if '-' in field:
+                lo, hi = map(int, field.split('-'))
+                cpus += range(lo, hi+1)
+            else:
+                cpus.append(int(field))
+    except ValueError:
+        return None
+    return cpus
+
+def cpuListString(cpus):
+    return ",".join(map(str, cpus))
+
+# CPUs this process may run on.  None if unknown
+def allowedCpus():
+    try:
+        f = open("/proc/self/status", "r")
+    except:
+        return None
+    cpus = None
+    for line in f:
+        if line.startswith("Cpus_allowed_list:"):
+            cpus = parseCpuList(line.split(':')[1].strip())
+    f.close()
+    return cpus
+
+# Read processor topology.  Returns (model name, list of (cpu, socket, core)) for allowed CPUs.
+# Without /proc/cpuinfo, every CPU is treated as separate core of single socket
+def readTopology():
+    model = "unknown"
+    entries = {}
+    try:
+        f = open("/proc/cpuinfo", "r")
+        cpu = -1
+        for line in f:
+            fields = line.split(':', 1)
+            if len(fields) != 2:
+                continue
+            key = fields[0].strip()
+            val = fields[1].strip()
+            if key == "processor":
+                cpu = int(val)
+                entries[cpu] = [0, cpu]
+            elif key == "physical id" and cpu in entries:
+                entries[cpu][0] = int(val)
+            elif key == "core id" and cpu in entries:
+                entries[cpu][1] = int(val)
+            elif key == "model name":
+                model = val
+        f.close()
+    except Exception as e:
+        entries = {}
+    if len(entries) == 0:
+        for cpu in range(multiprocessing.cpu_count()):
+            entries[cpu] = [0, cpu]
+    allowed = allowedCpus()
+    cpus = sorted(entries.keys())
+    return (model, [(cpu, entries[cpu][0], entries[cpu][1]) for cpu in cpus if allowed is None or cpu in allowed])
+
+# Order in which CPUs are assigned to threads.
+# close: cores in order, socket by socket.  spread: round robin among sockets.
+# Physical cores come before hyperthread siblings
+def cpuOrder(topo, spread):
+    cores = {}
+    for (cpu, socket, core) in topo:
+        if (socket, core) not in cores:
+            cores[(socket, core)] = []
+        cores[(socket, core)].append(cpu)
+    sockets = sorted(set([socket for (cpu, socket, core) in topo]))
+    socketCores = [[cores[key] for key in sorted(cores.keys()) if key[0] == socket] for socket in sockets]
+    coreList = []
+    if spread:
+        for i in range(max([len(sc) for sc in socketCores] + [0])):
+            for sc in socketCores:
+                if i < len(sc):
+                    coreList.append(sc[i])
+    else:
+        for sc in socketCores:
+            coreList += sc
+    order = []
+    level = 0
+    while len(order) < len(topo):
+        for cpus in coreList:
+            if level < len(cpus):
+                order.append(cpus[level])
+        level += 1
+    return order
+
+# CPUs used by run with threadCount threads.  None when not pinned.
+# With more threads than CPUs, threads share all of the CPUs
+def placementCpus(placement, threadCount):
+    if placement == Placement.none or len(topology) == 0:
+        return None
+    order = cpuOrder(topology, placement == Placement.spread)
+    return order[:max(min(threadCount, len(order)), 1)]
+
+# Command prefix and environment for run with threadCount threads.
+# Environment is None when inherited unchanged
+def placementSetup(placement, threadCount):
+    cpus = placementCpus(placement, threadCount)
+    if cpus is None:
+        return ([], None)
+    env = dict(os.environ)
+    env["OMP_PROC_BIND"] = Placement.names[placement]
+    env["OMP_PLACES"] = ",".join(["{%d}" % cpu for cpu in cpus])
+    prefix = [tasksetProg, "-c", cpuListString(cpus)] if tasksetProg is not None else []
+    return (prefix, env)
+
+def findProgram(name):
+    for d in os.environ.get("PATH", "").split(os.pathsep):
+        path = os.path.join(d, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+# Record topology and CPUs used by each policy and thread count
+def reportTopology(model, placementList, threadList):
+    sockets = sorted(set([socket for (cpu, socket, core) in topology]))
+    coreCount = len(set([(socket, core) for (cpu, socket, core) in topology]))
+    outmsg("Topology: %d CPUs, %d cores, %d sockets.  Model: %s" % (len(topology), coreCount, len(sockets), model))
+    for socket in sockets:
+        outmsg("\tSocket %d: CPUs %s" % (socket, cpuListString([cpu for (cpu, s, core) in topology if s == socket])))
+    for placement in placementList:
+        if placement == Placement.none:
+            continue
+        for threadCount in threadList:
+            outmsg("\tPlacement %s, %d threads: OMP_PROC_BIND=%s, CPUs %s" %
+                   (Placement.names[placement], threadCount, Placement.names[placement], cpuListString(placementCpus(placement, threadCount))))
+    if tasksetProg is None and placementList != [Placement.none]:
+        outmsg("Couldn't find taskset.  Pinning only OMP threads, using OMP_PLACES")
+
 def generateFileName(template):
     n = len(template)
     ls = []
@@ -245,11 +533,17 @@ def generateFileName(template):
     return "".join(ls)
 
 def run(name, args):
-    global outFile, doCheck
+    global outFile, doCheck, topology, tasksetProg
     scale = 1
     updateList = [UpdateMode.batch, UpdateMode.synchronous]
     threadLimit = 100
-    optString = "hs:u:t:f:c"
+    scaling = False
+    sizeList = scalingSizeList
+    typeList = scalingTypeList
+    ratType = scalingRatType
+    placementList = [Placement.none]
+    cpuPool = None
+    optString = "hs:u:t:f:cSk:g:r:P:a:"
     optlist, args = getopt.getopt(args, optString)
     otherArgs = []
 
@@ -283,20 +577,73 @@ def run(name, args):
             doCheck = True
         elif opt == '-t':
             threadLimit = int(val)
+        elif opt == '-S':
+            scaling = True
+        elif opt == '-k':
+            sizeList = [int(v) for v in val.split(":")]
+        elif opt == '-g':
+            typeList = val.split(":")
+        elif opt == '-r':
+            ratType = val
+        elif opt == '-P':
+            placementList = [Placement().parse(p) for p in val.split(":") if p != ""]
+            if len(placementList) == 0 or -1 in placementList:
+                print "Invalid placement policies '%s'" % val
+                usage(name)
+        elif opt == '-a':
+            cpuPool = parseCpuList(val)
+            if cpuPool is None or len(cpuPool) == 0:
+                print "Invalid CPU list '%s'" % val
+                usage(name)
         else:
             outmsg("Unknown option '%s'" % opt)
             usage(name)
     
+    # Check placement before spending time generating inputs
+    if cpuPool is not None and Placement.none in placementList:
+        print "CPU list (-a) requires pinned placement policies (-P close or -P spread)"
+        usage(name)
+    model, topology = readTopology()
+    if cpuPool is not None:
+        topology = [entry for entry in topology if entry[0] in cpuPool]
+        if len(topology) == 0:
+            outmsg("None of CPUs %s available" % cpuListString(cpuPool))
+            return
+    tasksetProg = findProgram("taskset")
+
+    # Generate any missing inputs before taking measurements
+    if scaling:
+        graphs = [(size, gtype) for size in sizeList for gtype in typeList]
+        rats = [(size, ratType, datagen.loadFactor(size)) for size in sizeList]
+    else:
+        graphs = [(size, gtype) for (size, gtype, rtype, load) in benchmarkList]
+        rats = [(size, rtype, load) for (size, gtype, rtype, load) in benchmarkList]
+    datagen.ensureInputs(dataDir, graphs, rats, multiprocessing.cpu_count())
+
+    if scaling:
+        threadList = scalingThreads(threadLimit)
+    else:
+        threadList = sorted(set([t for (t, steps) in synchRunList + otherRunList if t <= threadLimit]))
+    reportTopology(model, placementList, threadList)
+
     tstart = datetime.datetime.now()
 
     ok = True
     for u in updateList:
-        ok = ok and sweep(u, threadLimit, scale, otherArgs)
+        if scaling:
+            ok = scalingSweep(u, sizeList, typeList, ratType, threadLimit, scale, placementList) and ok
+        else:
+            ok = ok and sweep(u, threadLimit, scale, placementList, otherArgs)
     
     delta = datetime.datetime.now() - tstart
     secs = delta.seconds + 24 * 3600 * delta.days + 1e-6 * delta.microseconds
     print "Total test time = %.2f secs." % secs
 
+    if scaling:
+        if outFile:
+            outFile.close()
+        return
+
     grade.grade(ok, gmeanDict, sys.stdout)
 
     if outFile:
@@ -0,0 +1,88 @@
+# Python binding for the C simulator, built as shared library (make lib).
+# Steps the C engine in process.  Rat counts and positions are exposed as
+# ctypes arrays referring directly to the C engine's storage, so that they
+# can be read without copying or converting to text.
+
+import os
+import ctypes
+
+import rutil
+import sim
+
+# Shared libraries.  OMP version used when more than one thread requested
+libraryName = "./libcrun.so"
+ompLibraryName = "./libcrun-omp.so"
+
+# Update mode values of C engine (update_t in crun.h), indexed by sim.UpdateMode
+cUpdateModes = {sim.UpdateMode.synchronous : 0, sim.UpdateMode.batch : 1, sim.UpdateMode.ratOrder : 2}
+
+# Loaded libraries, indexed by file name
+libraryCache = {}
+
+def loadLibrary(fname):
+    if fname not in libraryCache:
+        if not os.path.exists(fname):
+            raise IOError("Library '%s' not found.  Build it with 'make lib'" % fname)
+        lib = ctypes.CDLL(os.path.abspath(fname))
+        lib.crun_init.restype = ctypes.c_void_p
+        lib.crun_init.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_uint32, ctypes.c_int]
+        lib.crun_step.restype = None
+        lib.crun_step.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+        for fn in [lib.crun_nnode, lib.crun_nrat]:
+            fn.restype = ctypes.c_int
+            fn.argtypes = [ctypes.c_void_p]
+        for fn in [lib.crun_rat_count, lib.crun_rat_position]:
+            fn.restype = ctypes.POINTER(ctypes.c_int)
+            fn.argtypes = [ctypes.c_void_p]
+        lib.crun_free.restype = None
+        lib.crun_free.argtypes = [ctypes.c_void_p]
+        libraryCache[fname] = lib
+    return libraryCache[fname]
+
+# Simulation state held by C engine
+class Engine:
+    lib = None
+    state = None
+    time = 0
+    ratCount = None     # Rat count for each node.  Length = N
+    ratPosition = None  # Node Id of each rat.  Length = R
+
+    # Raises IOError if library can't be loaded or input files can't be read
+    def __init__(self, gfname, rfname, seed = rutil.DEFAULTSEED, threadCount = 1):
+        self.lib = loadLibrary(libraryName if threadCount <= 1 else ompLibraryName)
+        self.state = self.lib.crun_init(gfname, rfname, seed, threadCount)
+        if self.state is None:
+            raise IOError("C engine couldn't load graph '%s' and rats '%s'" % (gfname, rfname))
+        self.time = 0
+        nnode = self.lib.crun_nnode(self.state)
+        nrat = self.lib.crun_nrat(self.state)
+        # Views of engine's arrays.  Contents change as engine steps
+        self.ratCount = self.view(self.lib.crun_rat_count(self.state), nnode)
+        self.ratPosition = self.view(self.lib.crun_rat_position(self.state), nrat)
+
+    # Array of n ints referring to storage at ptr
+    def view(self, ptr, n):
+        if n == 0:
+            return (ctypes.c_int * 0)()
+        return ctypes.cast(ptr, ctypes.POINTER(ctypes.c_int * n)).contents
+
+    def nodeCount(self):
+        return len(self.ratCount)
+
+    def step(self, update = sim.UpdateMode.batch, count = 1):
+        if update not in cUpdateModes:
+            raise ValueError("C engine doesn't support update mode %d" % update)
+        self.lib.crun_step(self.state, count, cUpdateModes[update])
+        self.time += count
+
+    # Copy of counts, in same form as Simulator.populationList
+    def populationList(self):
+        return self.ratCount[:]
+
+    # Release engine state.  Views of counts and positions become invalid
+    def close(self):
+        if self.state is not None:
+            self.lib.crun_free(self.state)
+            self.state = None
+            self.ratCount = None
+            self.ratPosition = None
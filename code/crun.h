@@ -128,6 +128,9 @@ double *double_alloc(size_t n);
 /* Read rat file and initialize simulation state */
 state_t *read_rats(graph_t *g, FILE *infile, random_t global_seed);
 
+/* Free simulation state.  Doesn't free graph */
+void free_rats(state_t *s);
+
 
 /* Generate done message from simulator */
 void done();
@@ -142,5 +145,11 @@ void show(state_t *s, bool show_counts);
 /* Run simulation */
 void simulate(state_t *s, int count, update_t update_mode, int dinterval, bool display);
 
+/* Prepare state for stepping with simulate_steps() */
+void init_simulation(state_t *s);
+
+/* Run simulation steps without generating output */
+void simulate_steps(state_t *s, int count, update_t update_mode);
+
 #define CRUN_H
 #endif /* CRUN_H */
@@ -0,0 +1,64 @@
+/*
+  Entry points for using the C simulator as a shared library.
+  Allows Python code (see cengine.py) to step the simulation and
+  read the rat counts and positions in place, without generating text output.
+*/
+
+#include "crun.h"
+
+/* Load graph and rats, and prepare for stepping.  Returns NULL if failed */
+state_t *crun_init(char *gfname, char *rfname, random_t global_seed, int thread_count) {
+    FILE *gfile = fopen(gfname, "r");
+    if (gfile == NULL) {
+	outmsg("Couldn't open graph file %s\n", gfname);
+	return NULL;
+    }
+    graph_t *g = read_graph(gfile);
+    fclose(gfile);
+    if (g == NULL)
+	return NULL;
+    FILE *rfile = fopen(rfname, "r");
+    if (rfile == NULL) {
+	outmsg("Couldn't open rat position file %s\n", rfname);
+	free_graph(g);
+	return NULL;
+    }
+    state_t *s = read_rats(g, rfile, global_seed);
+    fclose(rfile);
+    if (s == NULL) {
+	free_graph(g);
+	return NULL;
+    }
+    s->nthread = thread_count;
+    init_simulation(s);
+    return s;
+}
+
+/* Run count steps */
+void crun_step(state_t *s, int count, int update_mode) {
+    simulate_steps(s, count, (update_t) update_mode);
+}
+
+int crun_nnode(state_t *s) {
+    return s->g->nnode;
+}
+
+int crun_nrat(state_t *s) {
+    return s->nrat;
+}
+
+/* Rat count for each node.  Length = N.  Valid until crun_free */
+int *crun_rat_count(state_t *s) {
+    return s->rat_count;
+}
+
+/* Node Id for each rat.  Length = R.  Valid until crun_free */
+int *crun_rat_position(state_t *s) {
+    return s->rat_position;
+}
+
+void crun_free(state_t *s) {
+    graph_t *g = s->g;
+    free_rats(s);
+    free_graph(g);
+}
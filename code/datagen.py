@@ -0,0 +1,209 @@
+# Generation of graph and rat files for benchmarks and tests.
+# Files follow naming conventions of data directory:
+#   g-TN.gph:     Graph of type T (u: uniform, t: tiled, f: fractal) with N nodes
+#   r-N-RL.rats:  Rats for N-node graph, distribution R (u: uniform, d: diagonal,
+#                 r: lower right, l: upper left), with load factor L
+# Parameters of files in data directory are given by tables below,
+# and are extended to other sizes by simple rules.
+#
+# Files in the data directory are used when present.  Others are generated on demand
+# into a cache subdirectory, with names that include a hash of all generation parameters,
+# so that changing a parameter never reuses a stale file.  Generated files contain no
+# timestamps, and so are identical on every machine.  Missing files are generated
+# concurrently by a pool of processes.
+
+import sys
+import os
+import math
+import hashlib
+import multiprocessing
+
+import gengraph
+
+# Tile sizes of tiled graphs, indexed by grid dimension k.  Other sizes use defaultTile
+tileSizes = {2 : 2, 8 : 4, 20 : 5, 32 : 8, 160 : 10}
+defaultTile = 10
+
+# Load factors, indexed by number of nodes
+loadFactors = {4 : 1, 64 : 5, 400 : 10, 1024 : 10, 25600 : 40}
+
+# Rat distributions
+ratModes = {'u' : gengraph.RatMode.uniform, 'd' : gengraph.RatMode.diagonal,
+            'r' : gengraph.RatMode.lowright, 'l' : gengraph.RatMode.upleft}
+
+# Seeds used for rat files.  Assigned in sequence by graph size and distribution
+seedBase = 1001
+seedSizes = [4, 64, 400, 1024, 25600]
+seedTypes = ['r', 'u', 'd']
+
+# Subdirectory of data directory holding generated files
+cacheSubdirectory = "generated"
+
+# Number of hex digits of parameter hash included in generated file names
+keyDigits = 12
+
+# Change when generators change in a way that alters their output
+generatorVersion = 1
+
+def graphFileName(dataDir, graphSize, graphType):
+    return os.path.join(dataDir, "g-" + graphType + str(graphSize) + ".gph")
+
+def ratFileName(dataDir, graphSize, ratType, loadFactor):
+    return os.path.join(dataDir, "r-" + str(graphSize) + '-' + ratType + str(loadFactor) + ".rats")
+
+# Grid dimension for graph size.  Returns 0 if size isn't square
+def gridSize(graphSize):
+    k = int(math.sqrt(graphSize) + 0.5)
+    return k if k * k == graphSize else 0
+
+def tileSize(k):
+    return tileSizes[k] if k in tileSizes else defaultTile
+
+def loadFactor(graphSize):
+    if graphSize in loadFactors:
+        return loadFactors[graphSize]
+    return 40 if graphSize >= 25600 else 10
+
+# Seed for rat file.  Sizes beyond those of data directory continue the sequence,
+# ordered by size
+def ratSeed(graphSize, ratType):
+    tcount = len(seedTypes) + 1
+    tidx = seedTypes.index(ratType) if ratType in seedTypes else len(seedTypes)
+    if graphSize in seedSizes and ratType in seedTypes:
+        return seedBase + len(seedTypes) * seedSizes.index(graphSize) + tidx
+    return seedBase + len(seedTypes) * len(seedSizes) + tcount * graphSize + tidx
+
+# Complete description of how file is generated.  None if parameters invalid
+def graphParams(graphSize, graphType):
+    k = gridSize(graphSize)
+    if k == 0 or graphType not in "utf":
+        return None
+    tile = tileSize(k) if graphType == 't' else 0
+    return ("graph", generatorVersion, k, graphType, tile)
+
+def ratParams(graphSize, ratType, load):
+    k = gridSize(graphSize)
+    if k == 0 or ratType not in ratModes:
+        return None
+    return ("rats", generatorVersion, k, ratType, load, ratSeed(graphSize, ratType))
+
+def paramKey(params):
+    return hashlib.sha1(repr(params)).hexdigest()[:keyDigits]
+
+def cachePath(dataDir, fname, params):
+    base, ext = os.path.splitext(os.path.basename(fname))
+    return os.path.join(dataDir, cacheSubdirectory, base + "-" + paramKey(params) + ext)
+
+# Path of graph file: file in data directory if present, otherwise cached file
+def graphPath(dataDir, graphSize, graphType):
+    gfname = graphFileName(dataDir, graphSize, graphType)
+    params = graphParams(graphSize, graphType)
+    if os.path.exists(gfname) or params is None:
+        return gfname
+    return cachePath(dataDir, gfname, params)
+
+def ratPath(dataDir, graphSize, ratType, load = None):
+    if load is None:
+        load = loadFactor(graphSize)
+    rfname = ratFileName(dataDir, graphSize, ratType, load)
+    params = ratParams(graphSize, ratType, load)
+    if os.path.exists(rfname) or params is None:
+        return rfname
+    return cachePath(dataDir, rfname, params)
+
+# Write file described by params.  Returns True if successful
+def generateFile(fname, params):
+    if params[0] == "graph":
+        (kind, version, k, graphType, tile) = params
+        g = gengraph.Graph(k = k, fractal = graphType == 'f', tile = tile)
+        # Omit timestamp, so that file contents depend only on parameters
+        g.commentList = ["# Parameters: k = %d, %s, tile = %d" % (k, "fractal" if graphType == 'f' else "uniform", tile)]
+        return g.store(fname)
+    else:
+        (kind, version, k, ratType, load, seed) = params
+        g = gengraph.Graph()
+        g.k = k
+        g.nodeCount = k * k
+        return g.makeRats(fname, ratModes[ratType], load, seed, timestamp = False)
+
+# Worker function for process pool.  Must be at top level so that it can be pickled.
+# Writes to temporary file, so that concurrent or interrupted runs never leave partial file
+def generateEntry(entry):
+    fname, params = entry
+    tname = fname + ".%d.tmp" % os.getpid()
+    try:
+        ok = generateFile(tname, params)
+        if ok:
+            os.rename(tname, fname)
+        elif os.path.exists(tname):
+            os.remove(tname)
+    except Exception as e:
+        sys.stderr.write("Generating '%s' raised exception: %s\n" % (fname, e))
+        ok = False
+    return (fname, ok)
+
+# Make sure that graph and rat files are available, generating missing ones.
+# graphs: list of (graphSize, graphType).  rats: list of (graphSize, ratType, load).
+# Returns True if all files available
+def ensureInputs(dataDir, graphs = [], rats = [], jobCount = 1):
+    entries = []
+    ok = True
+    for (graphSize, graphType) in graphs:
+        fname = graphPath(dataDir, graphSize, graphType)
+        params = graphParams(graphSize, graphType)
+        if params is None and not os.path.exists(fname):
+            sys.stderr.write("Error.  Can't generate graph with size %d, type '%s'\n" % (graphSize, graphType))
+            ok = False
+        entries.append((fname, params))
+    for (graphSize, ratType, load) in rats:
+        fname = ratPath(dataDir, graphSize, ratType, load)
+        params = ratParams(graphSize, ratType, load)
+        if params is None and not os.path.exists(fname):
+            sys.stderr.write("Error.  Can't generate rats for graph size %d, type '%s'\n" % (graphSize, ratType))
+            ok = False
+        entries.append((fname, params))
+    missing = []
+    for (fname, params) in entries:
+        if params is not None and not os.path.exists(fname) and (fname, params) not in missing:
+            missing.append((fname, params))
+    if len(missing) == 0:
+        return ok
+    cdir = os.path.join(dataDir, cacheSubdirectory)
+    if not os.path.exists(cdir):
+        try:
+            os.makedirs(cdir)
+        except OSError:
+            # May have been created concurrently
+            if not os.path.isdir(cdir):
+                sys.stderr.write("Error.  Couldn't create directory '%s'\n" % cdir)
+                return False
+    for (fname, params) in missing:
+        sys.stderr.write("Generating '%s'\n" % fname)
+    if jobCount <= 1 or len(missing) == 1:
+        results = map(generateEntry, missing)
+    else:
+        pool = multiprocessing.Pool(min(jobCount, len(missing)))
+        try:
+            results = pool.map(generateEntry, missing, 1)
+        finally:
+            pool.close()
+            pool.join()
+    for (fname, fok) in results:
+        if not fok:
+            sys.stderr.write("Error.  Couldn't generate '%s'\n" % fname)
+            ok = False
+    return ok
+
+# Make sure graph file is available.  Returns path, or None if failed
+def ensureGraph(dataDir, graphSize, graphType):
+    if not ensureInputs(dataDir, graphs = [(graphSize, graphType)]):
+        return None
+    return graphPath(dataDir, graphSize, graphType)
+
+# Make sure rat file is available.  Returns path, or None if failed
+def ensureRats(dataDir, graphSize, ratType, load = None):
+    if load is None:
+        load = loadFactor(graphSize)
+    if not ensureInputs(dataDir, rats = [(graphSize, ratType, load)]):
+        return None
+    return ratPath(dataDir, graphSize, ratType, load)
@@ -28,6 +28,38 @@ class RatMode:
     (uniform, diagonal, upleft, lowright) =  range(4)
     modeNames = ["uniform", "diagonal", "upper-left", "lower-right"]
 
+class NodeOrder:
+    # Different options for ordering nodes to improve memory locality
+    # natural: Row-major order of grid
+    # rcm:     Reverse Cuthill-McKee.  Breadth-first, reducing bandwidth of adjacency matrix
+    # hilbert: Along Hilbert curve through grid
+    # hub:     Nodes in decreasing order of degree, so that hubs are together
+    (natural, rcm, hilbert, hub) = range(4)
+    orderNames = ["natural", "rcm", "hilbert", "hub"]
+
+    def parse(self, name):
+        if name in self.orderNames:
+            return self.orderNames.index(name)
+        return -1
+
+# Compute position of grid point (x, y) along Hilbert curve through n x n grid
+# n must be power of 2
+def hilbertIndex(n, x, y):
+    d = 0
+    s = n / 2
+    while s > 0:
+        rx = 1 if (x & s) > 0 else 0
+        ry = 1 if (y & s) > 0 else 0
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate quadrant
+        if ry == 0:
+            if rx == 1:
+                x = n-1 - x
+                y = n-1 - y
+            x, y = y, x
+        s /= 2
+    return d
+
 class Graph:
     k = 0
     nodeCount = 0
@@ -185,6 +217,79 @@ class Graph:
             result[idx] += 1
         return result
 
+    # Generate list with entry for each node, giving sorted list of its neighbors (excluding self)
+    def adjacency(self):
+        result = [[] for i in range(self.nodeCount)]
+        for (i, j) in self.edgeList():
+            result[i].append(j)
+        return result
+
+    # Reorderings of nodes.  Each returns list order, such that order[i] is the
+    # Id of the node that should be placed at position i
+
+    def rcmOrder(self):
+        adj = self.adjacency()
+        degree = [len(a) for a in adj]
+        visited = [False] * self.nodeCount
+        order = []
+        # Start each connected component from a node of minimum degree
+        starts = range(self.nodeCount)
+        starts.sort(key = lambda i: degree[i])
+        for start in starts:
+            if visited[start]:
+                continue
+            visited[start] = True
+            queue = [start]
+            head = 0
+            while head < len(queue):
+                u = queue[head]
+                head += 1
+                nbrs = [v for v in adj[u] if not visited[v]]
+                nbrs.sort(key = lambda v: degree[v])
+                for v in nbrs:
+                    visited[v] = True
+                    queue.append(v)
+            order += queue
+        order.reverse()
+        return order
+
+    def hilbertOrder(self):
+        n = 1
+        while n < self.k:
+            n *= 2
+        order = range(self.nodeCount)
+        order.sort(key = lambda id: hilbertIndex(n, id % self.k, id / self.k))
+        return order
+
+    def hubOrder(self):
+        degree = self.degreeList()
+        order = range(self.nodeCount)
+        order.sort(key = lambda id: -degree[id])
+        return order
+
+    # Get node ordering of specified type
+    def ordering(self, mode = NodeOrder.natural):
+        if mode == NodeOrder.rcm:
+            return self.rcmOrder()
+        elif mode == NodeOrder.hilbert:
+            return self.hilbertOrder()
+        elif mode == NodeOrder.hub:
+            return self.hubOrder()
+        return range(self.nodeCount)
+
+    # Average distance between endpoints of edges when nodes placed according to order.
+    # Smaller values indicate better memory locality
+    def edgeSpan(self, order = None):
+        if order is None:
+            order = range(self.nodeCount)
+        rank = [0] * self.nodeCount
+        for pos in range(len(order)):
+            rank[order[pos]] = pos
+        if len(self.edges) == 0:
+            return 0.0
+        total = sum([abs(rank[i] - rank[j]) for (i, j) in self.edges])
+        return float(total) / len(self.edges)
+
     # Store graph
     def store(self, fname = ""):
         if fname == "":
@@ -206,10 +311,12 @@ class Graph:
         return True
 
     # Generate rats for graph and write to file
-    def makeRats(self, fname = "", mode = RatMode.uniform, load = 1, seed = rutil.DEFAULTSEED):
+    # Omit timestamp to make file contents depend only on parameters
+    def makeRats(self, fname = "", mode = RatMode.uniform, load = 1, seed = rutil.DEFAULTSEED, timestamp = True):
         clist = []
-        tgen = datetime.datetime.now()
-        clist.append("# Generated %s" % tgen.ctime())
+        if timestamp:
+            tgen = datetime.datetime.now()
+            clist.append("# Generated %s" % tgen.ctime())
         clist.append("# Parameters: load = %d, mode = %s, seed = %d" % (load, RatMode.modeNames[mode], seed))
         rng = rutil.RNG([seed])
         if fname == "":
@@ -5,42 +5,94 @@ import sys
 import getopt
 import datetime
 import math
+import array
 
 import rutil
 import gengraph
 import sim
 import viz
+import instrument
+import streamio
+import transport
+import replay
 
 def usage(name):
-    print "Usage: %s [-h] [-d] [-g GFILE] [-r RFILE] [-n STEPS] [-s SEED] [-u (s|r|b)] [-i INT] [-m (q|s|d)] [-p PERIOD] [-v (a|h|b)] [-c CFILE]"
+    print "Usage: %s [-h] [-d] [-g GFILE] [-r RFILE] [-n STEPS] [-s SEED] [-u (s|r|b|f|a)] [-B POLICY] [-E SPEC] [-i INT] [-m (q|s|d|t)] [-p PERIOD] [-v (a|h|b)] [-P (s|m)] [-c CFILE] [-T TFILE] [-k KFILE] [-K KFILE] [-o RFILE] [-O ORDER] [-w OFILE] [-b BUFS] [-S ADDR] [-I IFILE] [-L ADDR] [-x STEP] [-e ENGINE]"
     print "\t-h        Print this message"
     print "\t-d        Operate in driven mode, serving as visualizer for another simulator"
     print "\t          In driven mode, only additional options -m, -p, -v, and -c are useful"
     print "\t-g GFILE  Graph file"
     print "\t-r RFILE  Initial rat position file"
+    print "\t-k KFILE  Resume from checkpoint file rather than rat position file"
+    print "\t          Update mode taken from checkpoint unless given with -u"
+    print "\t-K KFILE  Write checkpoint file at end of run"
+    print "\t-o RFILE  Write final rat positions as rat position file"
+    print "\t-O ORDER  Lay out node storage in specified order.  Requires -e c.  Results are unchanged"
+    print "\t          natural, rcm (reverse Cuthill-McKee), hilbert (Hilbert curve), or hub (hubs first)"
+    print "\t-e ENGINE Simulation engine:"
+    print "\t          o: Objects.  Objects for each rat and node (default)"
+    print "\t          c: Compact.  Arrays of positions, seeds, and counts.  Uses less memory and runs faster"
+    print "\t                       Gives identical results.  Only engine supporting -O"
+    print "\t                       While few nodes are occupied, work and output scale with occupied nodes"
     print "\t-n STEPS  Number of simulation steps"
     print "\t-s SEED   Initial RNG seed"
     print "\t-u UPDT   Update mode:"
     print "\t          s: Synchronous.   Compute all new states and then update all."
     print "\t          r: Rat order:     Compute and update each rat state in sequence"
     print "\t          b: Batched.       Repeatedly compute states for small batches of rats and then update"
+    print "\t          f: Fast.          Synchronous, sampling moves from per-node alias tables"
+    print "\t                            Statistically equivalent to s, but does not match reference results"
+    print "\t          a: Auto-tuned.    Batched, with batch size chosen by policy given with -B"
+    print "\t-B POLICY Batch size policy for update mode a.  Batch size and policy written as '# BATCH' line of output"
+    print "\t          size:N    Batches of N rats"
+    print "\t          count:N   N batches per step"
+    print "\t          measured: Time trial steps with sizes from that of mode b up to all rats, and use fastest (default)"
+    print "\t-E SPEC   Detect equilibrium, specified as SIG[:TOL[:WINDOW[:ACTION]]]"
+    print "\t          SIG: l1 (fraction of rats moving between nodes) or occupancy (fraction of nodes occupied)"
+    print "\t          Equilibrium when means of SIG over two halves of last WINDOW steps (default 20)"
+    print "\t          differ by at most TOL (default 0.01) relative to mean"
+    print "\t          ACTION: stop (default), or sparseK to continue, with counts or images only every K steps"
+    print "\t          Step of detection reported on stderr, and as '# EQUILIBRIUM' line of drive or stats output"
     print "\t-i INT    Generate image only once every INT steps"
     print "\t-m MODE   Output mode:"
     print "\t          q: Quiet.  Only statistics"
     print "\t          s: Step.   Show result of each step (Default)"
     print "\t          d: Drive.  Generate data to drive another program operating as visualizer"
+    print "\t          t: Stats.  Generate one line per step giving step, maximum node count, number of"
+    print "\t                     occupied nodes, variance of load, and entropy of rat distribution"
+    print "\t                     In driven mode, computed for each step for which driver provides counts"
     print "\t-p PERIOD Target refresh period (seconds)"
     print "\t-v VIS    Visualization Mode:"
     print "\t          b: Both    Show both ways (default)"
     print "\t          a: ASCII.  Print as numbers on grid"
     print "\t          h: Heatmap Show as graphical heatmap"
+    print "\t-P POOL   Combining of node counts when heatmap has fewer tiles than graph has nodes:"
+    print "\t          s: Sum (default)"
+    print "\t          m: Max"
+    print "\t          In heatmap, '+'/'-' or left/right click zoom, arrows pan, and '0' shows whole graph"
     print "\t-c CFILE  Capture final state as image (extensions .jpg and .png supported)"
+    print "\t-w OFILE  Write output of drive or stats mode to OFILE, using background thread"
+    print "\t          Compressed when OFILE has extension .gz, .bz2, or .xz"
+    print "\t          Uncompressed drive output is indexed in OFILE.idx for replay with -x"
+    print "\t-b BUFS   In drive or stats mode, format and write output on separate thread, overlapping it"
+    print "\t          with simulation.  Use BUFS frame buffers (2 = double buffering) to bound memory"
+    print "\t-S ADDR   In drive mode, send output to visualizer listening at ADDR (PORT, HOST:PORT, or unix:PATH)"
+    print "\t          Simulation proceeds whether or not visualizer attached.  Frames dropped while detached"
+    print "\t-L ADDR   In driven mode, listen for simulators at ADDR rather than reading stdin"
+    print "\t          After simulator disconnects, wait for another to connect"
+    print "\t-I IFILE  In driven mode, read driver input from IFILE rather than stdin"
+    print "\t          Compressed input (from file or stdin) is detected and decompressed automatically"
+    print "\t-x STEP   In driven mode, replay IFILE interactively, starting at STEP"
+    print "\t          Frames located with index IFILE.idx, built when needed.  Enter 'h' for commands"
+    print "\t-T TFILE  Record time spent computing, moving, generating output, and rendering for each step"
+    print "\t          Writes JSON trace if TFILE has extension .json.  Otherwise writes per-step summary"
+    print "\t          Use '-' for stderr.  Not supported in driven mode"
     sys.exit(0)
 
 # Enumerated type for output mode
 # Extends limited form of basic simulator
 class OutputMode:
-    drive, quiet, step, error = range(4)
+    drive, quiet, step, stats, error = range(5)
 
     def parse(self, name):
         if len(name) != 1:
@@ -51,6 +103,8 @@ class OutputMode:
             return self.quiet
         elif name == 's':
             return self.step
+        elif name == 't':
+            return self.stats
         else:
             return self.error
 
@@ -59,6 +113,7 @@ class OutputMode:
 class VizSimulator(sim.Simulator):
 
     vizMode = viz.VizMode.heatmap
+    pooling = viz.Pooling.sum
     formatter = None
     displayInterval = 1
 
@@ -75,8 +130,8 @@ class VizSimulator(sim.Simulator):
     # Display graph
     def show(self, period = 0.0, last = False):
         if self.formatter is None:
-            k = int(math.sqrt(len(self.nodes)))
-            self.formatter = viz.Formatter(k, self.ratCount(), viz = self.vizMode)
+            k = int(math.sqrt(self.nodeCount()))
+            self.formatter = viz.Formatter(k, self.ratCount(), viz = self.vizMode, pooling = self.pooling)
         else:
             self.formatter.reset()
         self.formatter.printLine("t = %d." % self.time)
@@ -97,36 +152,40 @@ class VizSimulator(sim.Simulator):
         if self.formatter is not None:
             self.formatter.finishDynamic(wait = wait)
 
+    # Display graph, recording time when profiling
+    def render(self, period = 0.0):
+        if self.profiler is None:
+            self.show(period = period)
+        else:
+            self.profiler.begin("render")
+            self.show(period = period)
+            self.profiler.end()
+
     def simulate(self, stepCount = 1, update = sim.UpdateMode.synchronous, period = 0.0, displayInterval = 1):
+        # Choose batch size before starting clock, since tuning can run trial steps
+        self.updateBatchSize(update)
         tstart = datetime.datetime.now()
-        # Determine batch size
-        rcount = len(self.rats)
-        bsize = rcount
-        if update == sim.UpdateMode.batch:
-            bsize = self.batchSize
-        elif update == sim.UpdateMode.ratOrder:
-            bsize = 1
-        if self.verb == OutputMode.step:
-            self.show(period = period)
-        elif self.verb == OutputMode.drive:
-            self.driveOut()
-        for step in xrange(stepCount):
-            ridx = 0
-            while ridx < rcount:
-                bcount = min(bsize, rcount - ridx)
-                for i in xrange(bcount):
-                    r = self.rats[i+ridx]
-                    r.next(loadFactor = self.loadFactor)
-                for i in xrange(bcount):
-                    r = self.rats[i+ridx]
-                    r.move()
-                ridx += bcount
-            self.time += 1
-            display = step == stepCount-1 or ((step+1) % displayInterval) == 0
+        startTime = self.time
+        endTime = self.time + stepCount
+        # Visualization only needs selected steps, but driver output has frame for every step
+        interval = 1 if self.verb == OutputMode.drive else displayInterval
+        # Monitor needs every step
+        if self.monitor is not None:
+            interval = 1
+        for (t, counts) in self.steps(stepCount, update, interval):
+            found = self.checkEquilibrium(counts)
+            if found and self.monitor.action == sim.EquilibriumMonitor.stop:
+                endTime = t
+            elif found:
+                displayInterval = self.monitor.interval
+            display = t in [startTime, endTime] or (t % displayInterval) == 0
             if display and self.verb == OutputMode.step:
-                self.show(period = period)
+                self.render(period = period)
             elif self.verb == OutputMode.drive:
-                self.driveOut()
+                self.output()
+            if t == endTime:
+                break
+        stepCount = self.time - startTime
         self.finishDynamic()
         delta = datetime.datetime.now() - tstart
         secs = delta.seconds + 24 * 3600 * delta.days + 1e-6 * delta.microseconds
@@ -139,6 +198,14 @@ class VizSimulator(sim.Simulator):
         if self.verb == OutputMode.drive:
             self.driveDone()
 
+# Visualizing simulator using compact state
+class CompactVizSimulator(sim.CompactState, VizSimulator):
+    def __init__(self, graph, verb = OutputMode.step, vizMode = viz.VizMode.heatmap, order = None):
+        sim.CompactState.__init__(self, graph, order = order)
+        self.formatter = None
+        self.verb = verb
+        self.vizMode = vizMode
+
 # Special class to implement simulator in "driven mode"
 # This mode enables another simulator to generate data
 # and this simulator only to serve as a visualization tool
@@ -146,15 +213,26 @@ class DrivenSimulator(VizSimulator):
     # In this mode, don't model or track rats
     # Must keep track of rat count, since don't maintain list of rats
     nrats = 0
+    counts = None   # Rat count of each node, from most recent frame with counts
+    back = None     # Buffer into which next frame is read
+    inFile = None   # Source of driver input
+    listener = None # When set, accept driver input from successive socket connections
 
-    def __init__(self, verb = OutputMode.quiet, vizMode = viz.VizMode.heatmap):
+    def __init__(self, verb = OutputMode.quiet, vizMode = viz.VizMode.heatmap, inFile = None, listener = None):
+        self.listener = listener
+        if inFile is None and listener is None:
+            inFile = streamio.openInput()
+        self.inFile = inFile
         self.nrats = 0
+        self.counts = array.array('i')
+        self.back = None
         self.nodes = []
         self.rats = []
         self.time = 0
         self.verb = verb
         self.formatter = None
         self.vizMode = vizMode
+        self.outFile = sys.stdout
 
     def restart(self):
         self.time = 0
@@ -162,41 +240,175 @@ class DrivenSimulator(VizSimulator):
     def ratCount(self):
         return self.nrats
 
-    def loadCounts(self):
-        id = -1
-        for line in sys.stdin:
-            if line[-1] == '\n':
-                line = line[:-1]
+    def nodeCount(self):
+        return len(self.counts)
+
+    def populationList(self):
+        return self.counts.tolist()
+
+    def countView(self):
+        return sim.StateView(self.counts)
+
+    # Read frame header, skipping comment lines.  Returns (code, header line)
+    def loadHeader(self):
+        for line in self.inFile:
+            line = line.rstrip('\n')
             tokens = line.split()
-            if id == -1:
-                if len(tokens) >= 1 and tokens[0] == "DONE":
-                    return tokens[0]
-                if len(tokens) < 1 or tokens[0] != "STEP":
-                    self.errorMsg("Invalid driver input.  First line contents '%s'" % line)
-                    return "ERROR"
-                try:
-                    ncount, self.nrats = map(int, tokens[1:])
-                except Exception as e:
-                    self.errorMsg("Failed to receive parameter line from driver: %s.  Line contents '%s'" % (e, line))
-                    return "ERROR"
-                if self.nodes == []:
-                    self.nodes = [sim.Node(nid) for nid in xrange(ncount)]
-                else:
-                    for nid in xrange(ncount):
-                        self.nodes[nid].reset()
-            elif len(tokens) == 1 and tokens[0] == "END":
-                break
-            elif len(tokens) == 1:
+            # Comment lines, such as batch size header, can precede frame
+            if len(tokens) > 0 and tokens[0][0] == '#':
+                continue
+            if len(tokens) >= 1 and tokens[0] == "DONE":
+                return (tokens[0], line)
+            if len(tokens) < 1 or tokens[0] != "STEP":
+                self.errorMsg("Invalid driver input.  First line contents '%s'" % line)
+                return ("ERROR", line)
+            return ("OK", line)
+        return ("EOF", "")
+
+    # Read counts for frame as block, and convert them in bulk into back buffer.
+    # Buffers are swapped only when the frame is complete, so that counts of
+    # the previous frame remain intact if frame is empty or malformed
+    def loadCounts(self):
+        code, line = self.loadHeader()
+        if code != "OK":
+            return code
+        try:
+            ncount, nrats = map(int, line.split()[1:])
+        except Exception as e:
+            self.errorMsg("Failed to receive parameter line from driver: %s.  Line contents '%s'" % (e, line))
+            return "ERROR"
+        if self.back is None:
+            self.counts = array.array('i', [0] * ncount)
+            self.back = array.array('i', [0] * ncount)
+        elif ncount != len(self.counts):
+            self.errorMsg("Driver changed number of nodes from %d to %d" % (len(self.counts), ncount))
+            return "ERROR"
+        self.nrats = nrats
+        self.loadFactor = float(nrats) / ncount if ncount > 0 else 0.0
+        lines = self.inFile.readUntil("END\n")
+        if len(lines) == 0 or lines[-1].strip() != "END":
+            if len(lines) > ncount:
+                self.errorMsg("Malformed frame.  No END line after %d counts" % ncount)
+                return "ERROR"
+            # Input ended without DONE, possibly partway through frame
+            return "EOF"
+        lines.pop()
+        if len(lines) == 0:
+            return "EMPTY"
+        if len(lines) != ncount:
+            self.errorMsg("Driver gave %d counts.  Expected %d" % (len(lines), ncount))
+            return "ERROR"
+        try:
+            self.back[:] = array.array('i', map(int, lines))
+        except Exception:
+            # Find offending line
+            for id in xrange(len(lines)):
+                line = lines[id].rstrip('\n')
                 try:
-                    count = int(tokens[0])
+                    int(line)
                 except Exception as e:
                     self.errorMsg("Failed to receive input for node %d from driver: %s.  Line contents '%s'" % (id, e, line))
                     return "ERROR"
-                self.nodes[id].ratCount = count
-            else:
-                self.errorMsg("Failed to receive input for node %d from driver: %s.  Line contents '%s'" % (id, e, line))
-            id += 1
-        return "EMPTY" if id <= 1 else "OK"
+            self.errorMsg("Failed to convert counts from driver")
+            return "ERROR"
+        self.counts, self.back = self.back, self.counts
+        return "OK"
+
+    # Keep display responsive while waiting for input
+    def idle(self):
+        if self.formatter is not None and self.formatter.display is not None:
+            self.formatter.display.update()
+
+    # Load next frame.  When listening on socket, continue with next simulator
+    # to connect whenever current one goes away
+    def loadFrame(self):
+        while True:
+            if self.inFile is None:
+                self.inFile = self.listener.accept(self.idle)
+            code = self.loadCounts()
+            if code != "EOF" or self.listener is None:
+                return code
+            self.inFile.close()
+            self.inFile = None
+            self.errorMsg("Simulator disconnected")
+
+    # Load counts for step from indexed input.  For steps where driver
+    # provided no counts, use those of most recent step that has them
+    def loadStep(self, frames, step):
+        t = step
+        while True:
+            self.inFile = frames.frameReader(t)
+            code = self.loadCounts()
+            if code != "EMPTY" or t == 0:
+                break
+            t -= 1
+        self.time = step
+        return code
+
+    def replayHelp(self):
+        sys.stderr.write("Commands:\n")
+        sys.stderr.write("  n (or empty line)  Next step\n")
+        sys.stderr.write("  p                  Previous step\n")
+        sys.stderr.write("  +K, -K             Move forward or back K steps\n")
+        sys.stderr.write("  g STEP             Go to STEP\n")
+        sys.stderr.write("  s STEP             Scrub to STEP, showing each intermediate step\n")
+        sys.stderr.write("  q                  Quit\n")
+
+    # Show state for current step
+    def replayShow(self, period = 0.0):
+        if self.verb == OutputMode.step:
+            self.show(period = period)
+        elif self.verb == OutputMode.stats:
+            self.statsOut()
+        else:
+            print "t = %d." % self.time
+
+    # Interactive random access to recorded input
+    def replay(self, frames, step = 0, period = 0.0):
+        last = frames.frameCount() - 1
+        if last < 0:
+            self.errorMsg("No frames in input")
+            return
+        if self.verb == OutputMode.stats:
+            if self.loadStep(frames, 0) == "ERROR":
+                return
+            self.statsHeader()
+        target = step
+        while True:
+            target = max(0, min(target, last))
+            if self.loadStep(frames, target) == "ERROR":
+                break
+            self.replayShow()
+            sys.stderr.write("Step %d of %d> " % (self.time, last))
+            line = sys.stdin.readline()
+            if line == "":
+                break
+            tokens = line.split()
+            cmd = tokens[0] if len(tokens) > 0 else "n"
+            try:
+                if cmd == "n":
+                    target = self.time + 1
+                elif cmd == "p":
+                    target = self.time - 1
+                elif cmd[0] in "+-":
+                    target = self.time + int(cmd)
+                elif cmd == "g":
+                    target = int(tokens[1])
+                elif cmd == "s":
+                    dest = max(0, min(int(tokens[1]), last))
+                    dir = 1 if dest >= self.time else -1
+                    for t in xrange(self.time + dir, dest, dir):
+                        if self.loadStep(frames, t) == "ERROR":
+                            break
+                        self.replayShow(period = period)
+                    target = dest
+                elif cmd == "q":
+                    break
+                else:
+                    self.replayHelp()
+            except (ValueError, IndexError):
+                self.replayHelp()
+        self.finishDynamic()
                 
     def finishSim(self, tstart, count):
         self.finishDynamic()
@@ -212,8 +424,8 @@ class DrivenSimulator(VizSimulator):
     def simulate(self, stepCount = 1, update = sim.UpdateMode.synchronous, period = 0.0, displayInterval = 1):
         tstart = datetime.datetime.now()
         realStepCount = 0
-        code = self.loadCounts()
-        if code == "DONE":
+        code = self.loadFrame()
+        if code in ["DONE", "EOF"]:
             self.finishSim(tstart, realStepCount)
             return
         elif code == "ERROR":
@@ -225,9 +437,12 @@ class DrivenSimulator(VizSimulator):
             # Force delay after showing initial state
             if period > 0:
                 self.show(period = period)
+        elif self.verb == OutputMode.stats:
+            self.statsHeader()
+            self.statsOut()
         while True:
-            code = self.loadCounts()
-            if code == "DONE":
+            code = self.loadFrame()
+            if code in ["DONE", "EOF"]:
                 self.finishSim(tstart, realStepCount)
                 return
             elif code not in  ["OK", "EMPTY"]:
@@ -238,6 +453,8 @@ class DrivenSimulator(VizSimulator):
             realStepCount += 1
             if code == "OK" and self.verb == OutputMode.step:
                 self.show(period = period)
+            elif code == "OK" and self.verb == OutputMode.stats:
+                self.statsOut()
                 
 
 def run(name, args):
@@ -254,7 +471,24 @@ def run(name, args):
     vizm = viz.VizMode()
     vizMode = vizm.heatmap
     captureFile = ""
-    optlist, args = getopt.getopt(args, "hdg:r:R:n:s:u:m:p:i:v:c:")
+    profileFile = None
+    resumeFile = ""
+    checkpointFile = ""
+    orfname = ""
+    updateGiven = False
+    batchPolicy = None
+    pooling = viz.Pooling.sum
+    monitor = None
+    ofname = ""
+    ifname = ""
+    outputBuffers = 0
+    sendAddress = ""
+    listenAddress = ""
+    replayStep = None
+    compact = False
+    om = gengraph.NodeOrder()
+    nodeOrder = om.natural
+    optlist, args = getopt.getopt(args, "hdg:r:R:n:s:u:m:p:i:v:c:T:k:K:o:O:w:b:I:S:L:x:e:B:P:E:")
     for (opt, val) in optlist:
         if opt == '-h':
             usage(name)
@@ -268,16 +502,27 @@ def run(name, args):
         if opt == '-s':
             seed = int(val)
         if opt == '-u':
-            if len(val) != 1 or val not in "bsr":
+            if len(val) != 1 or val not in "bsrfa":
                 print "Error.  Unrecognized update mode '%s'" % val
                 usage(name)
                 return
+            updateGiven = True
             if val == 's':
                 updateMode = sim.UpdateMode.synchronous
             elif val == 'r':
                 updateMode = sim.UpdateMode.ratOrder
+            elif val == 'f':
+                updateMode = sim.UpdateMode.fast
+            elif val == 'a':
+                updateMode = sim.UpdateMode.tuned
             else:
                 updateMode = sim.UpdateMode.batch
+        if opt == '-B':
+            batchPolicy = sim.BatchPolicy().parse(val)
+            if batchPolicy is None:
+                print "Error.  Invalid batch size policy '%s'" % val
+                usage(name)
+                return
         if opt == '-m':
             verb = vm.parse(val)
             if verb == vm.error:
@@ -296,27 +541,136 @@ def run(name, args):
                 print "Error.  Invalid visualization mode '%s'" % val
                 usage(name)
                 return
+        if opt == '-E':
+            monitor = sim.EquilibriumMonitor().parse(val)
+            if monitor is None:
+                print "Error.  Invalid equilibrium specification '%s'" % val
+                usage(name)
+                return
+        if opt == '-P':
+            pooling = viz.Pooling().parse(val)
+            if pooling == viz.Pooling.error:
+                print "Error.  Invalid pooling '%s'" % val
+                usage(name)
+                return
         if opt == '-c':
             captureFile = val
+        if opt == '-T':
+            profileFile = val
+        if opt == '-k':
+            resumeFile = val
+        if opt == '-K':
+            checkpointFile = val
+        if opt == '-o':
+            orfname = val
+        if opt == '-w':
+            ofname = val
+        if opt == '-I':
+            ifname = val
+        if opt == '-b':
+            outputBuffers = int(val)
+        if opt == '-S':
+            sendAddress = val
+        if opt == '-L':
+            listenAddress = val
+        if opt == '-x':
+            replayStep = int(val)
+        if opt == '-e':
+            if val not in ['o', 'c']:
+                print "Error.  Unrecognized engine '%s'" % val
+                usage(name)
+                return
+            compact = val == 'c'
+        if opt == '-O':
+            nodeOrder = om.parse(val)
+            if nodeOrder < 0:
+                print "Error.  Unrecognized node order '%s'" % val
+                usage(name)
+                return
+    listener = None
+    frames = None
     if drivenMode:
-        s = DrivenSimulator(verb = verb, vizMode = vizMode)
+        inFile = None
+        try:
+            if replayStep is not None:
+                if ifname in ["", "-"]:
+                    print "Error.  Replay requires input file"
+                    usage(name)
+                    return
+                frames = replay.FrameFile(ifname)
+            elif listenAddress != "":
+                listener = transport.Listener(listenAddress)
+            else:
+                inFile = streamio.openInput(ifname)
+        except Exception as e:
+            print "Error.  Couldn't open driver input '%s': %s" % (listenAddress if listenAddress != "" else ifname, e)
+            return
+        s = DrivenSimulator(verb = verb, vizMode = vizMode, inFile = inFile, listener = listener)
     else:
         if gfname == "":
             print "Error.  Need graph file"
             usage(name)
             return
-        if irfname == "":
+        if irfname == "" and resumeFile == "":
             print "Error.  Need file of initial rat positions"
             usage(name)
             return
         g = gengraph.Graph()
         if not g.load(gfname):
             return
-        s = sim.Simulator(g) if verb == vm.drive else VizSimulator(g, verb = verb, vizMode = vizMode)
-        if not s.loadRats(irfname, seed):
+        order = None
+        if not compact and nodeOrder != om.natural:
+            print "Error.  Node orders require compact engine (-e c)"
+            return
+        if nodeOrder != om.natural:
+            order = g.ordering(nodeOrder)
+            sys.stderr.write("Node order %s.  Mean edge span %.1f (natural order %.1f)\n" %
+                             (om.orderNames[nodeOrder], g.edgeSpan(order), g.edgeSpan()))
+        if verb in [vm.drive, vm.stats]:
+            outFile = None
+            if sendAddress != "":
+                outFile = transport.SocketSink(sendAddress)
+            elif ofname != "":
+                try:
+                    if verb == vm.drive and streamio.Compression().fromName(ofname) == streamio.Compression.none:
+                        outFile = replay.openRecording(ofname)
+                    else:
+                        outFile = streamio.openOutput(ofname)
+                except Exception as e:
+                    print "Error.  Couldn't open output file '%s': %s" % (ofname, e)
+                    return
+            if compact:
+                s = sim.CompactSimulator(g, outFile = outFile, order = order)
+            else:
+                s = sim.Simulator(g, outFile = outFile)
+            s.statsOnly = verb == vm.stats
+            s.outputBuffers = outputBuffers
+        else:
+            if compact:
+                s = CompactVizSimulator(g, verb = verb, vizMode = vizMode, order = order)
+            else:
+                s = VizSimulator(g, verb = verb, vizMode = vizMode)
+        if resumeFile != "":
+            if not s.loadCheckpoint(resumeFile):
+                s.finish()
+                return
+            if not updateGiven:
+                updateMode = s.updateMode
+        elif not s.loadRats(irfname, seed):
             return
+        if batchPolicy is not None:
+            # Overrides batch size of tuned checkpoint
+            s.batchPolicy = batchPolicy
+            s.tunedBatchSize = 0
+        s.monitor = monitor
+        if profileFile is not None:
+            s.profiler = instrument.Profiler()
+    if isinstance(s, VizSimulator):
+        s.pooling = pooling
     try:
-        if verb == vm.drive:
+        if frames is not None:
+            s.replay(frames, replayStep, period = period)
+        elif verb in [vm.drive, vm.stats]:
             s.simulate(steps, update = updateMode, displayInterval = displayInterval)
         else:
             s.simulate(steps, update = updateMode, period = period, displayInterval = displayInterval)
@@ -324,8 +678,23 @@ def run(name, args):
         s.errorMsg("Error: %s" % E)
         s.finish()
         return
-    if verb != vm.drive:
+    finally:
+        if s.outFile not in [None, sys.stdout]:
+            s.outFile.close()
+            if isinstance(s.outFile, transport.SocketSink) and s.outFile.dropped > 0:
+                sys.stderr.write("%d frames not delivered to visualizer\n" % s.outFile.dropped)
+        if listener is not None:
+            listener.close()
+        if frames is not None:
+            frames.close()
+    if verb not in [vm.drive, vm.stats]:
         s.finish(captureFile)
+    if not drivenMode and checkpointFile != "":
+        s.storeCheckpoint(checkpointFile)
+    if not drivenMode and orfname != "":
+        s.storeRats(orfname)
+    if s.profiler is not None:
+        s.profiler.store(profileFile)
     
 if __name__ == "__main__":
     run(sys.argv[0], sys.argv[1:])
@@ -0,0 +1,298 @@
+#!/usr/bin/python
+
+# Load-imbalance profiler for candidate parallel decompositions.
+# Work for a rat on one step is the degree of its node's region (node plus neighbors),
+# since computing its next move requires the weight of every node in the region.
+# For each decomposition, the work of each partition is summed on every step,
+# and the imbalance is the ratio of maximum to mean partition work
+# (1.0 = perfect balance, P = all work in one of P partitions).
+#
+# Rat counts come either from running the (compact) Python simulator,
+# or from driver output of any simulator, e.g.:
+#   linux> ./crun -g GFILE -r RFILE -n 100 | ./imbalance.py -g GFILE -I -
+
+import sys
+import os
+import getopt
+
+import rutil
+import gengraph
+import sim
+import streamio
+import partition
+
+def usage(name):
+    print "Usage: %s [-h] -g GFILE (-r RFILE | -I IFILE) [-n STEPS] [-s SEED] [-u (s|r|b)] [-p PARTS] [-d DECOMPS] [-P PFILE] [-i INT]" % name
+    print "    -h         Print this message"
+    print "    -g GFILE   Graph file"
+    print "    -r RFILE   Simulate, starting from rat position file"
+    print "    -I IFILE   Read driver output from file ('-' for stdin)"
+    print "    -n STEPS   Number of simulation steps (default = %d)" % defaultSteps
+    print "    -s SEED    Initial RNG seed"
+    print "    -u UPDT    Update mode when simulating:"
+    print "               s: Synchronous.  r: Rat order.  b: Batch (default)"
+    print "    -p PARTS   Comma-separated partition counts (default = %s)" % ",".join([str(p) for p in defaultParts])
+    print "    -d DECOMPS Comma-separated decompositions (default = %s):" % ",".join(defaultDecomps)
+    for d in decompositionNames:
+        print "               %s: %s" % (d, decompositionDescriptions[d])
+    print "    -P PFILE   Also evaluate partition file (see partition.py).  Can be repeated"
+    print "    -i INT     Print imbalance every INT steps (default = 0: summary only)"
+    sys.exit(0)
+
+defaultSteps = 50
+defaultParts = [4, 8, 16]
+defaultDecomps = ['n', 'w', 'c', 'r']
+
+updateModes = {'s' : sim.UpdateMode.synchronous, 'r' : sim.UpdateMode.ratOrder, 'b' : sim.UpdateMode.batch}
+
+# Decompositions.  All but rat chunks assign each node (and the rats on it) to a partition
+decompositionNames = ['n', 'w', 'c', 'r']
+decompositionDescriptions = {
+    'n' : "Blocks of consecutive nodes, with equal numbers of nodes",
+    'w' : "Blocks of consecutive nodes, balanced by region degree",
+    'c' : "Nodes assigned cyclically",
+    'r' : "Blocks of consecutive rats, with equal numbers of rats (requires -r)"
+    }
+
+# Node partitions.  Each returns list giving partition of each node
+
+def nodeBlocks(nodeCount, partCount):
+    return [(nid * partCount) / nodeCount for nid in xrange(nodeCount)]
+
+def weightedBlocks(degrees, partCount):
+    return partition.splitWeights(degrees, partCount)
+
+def cyclicNodes(nodeCount, partCount):
+    return [nid % partCount for nid in xrange(nodeCount)]
+
+# Candidate decomposition of work among partitions
+class Decomposition:
+    name = ""
+    partCount = 1
+    partition = None  # Partition of each node.  None for rat chunks
+    degrees = []
+
+    # Node partition can be given explicitly, e.g., from partition file
+    def __init__(self, name, partCount, degrees, partition = None):
+        self.name = name
+        self.partCount = partCount
+        self.degrees = degrees
+        nodeCount = len(degrees)
+        if partition is not None:
+            self.partition = partition
+        elif name == 'n':
+            self.partition = nodeBlocks(nodeCount, partCount)
+        elif name == 'w':
+            self.partition = weightedBlocks(degrees, partCount)
+        elif name == 'c':
+            self.partition = cyclicNodes(nodeCount, partCount)
+        else:
+            self.partition = None
+
+    def label(self):
+        return "%s%d" % (self.name, self.partCount)
+
+    # Work of each partition, given rat counts (and rat positions for rat chunks)
+    def work(self, counts, positions = None):
+        work = [0] * self.partCount
+        degrees = self.degrees
+        if self.partition is None:
+            rcount = len(positions)
+            for p in xrange(self.partCount):
+                lo = (p * rcount) / self.partCount
+                hi = ((p+1) * rcount) / self.partCount
+                work[p] = sum([degrees[positions[ridx]] for ridx in xrange(lo, hi)])
+        else:
+            partition = self.partition
+            for nid in xrange(len(counts)):
+                c = counts[nid]
+                if c > 0:
+                    work[partition[nid]] += c * degrees[nid]
+        return work
+
+    def imbalance(self, counts, positions = None):
+        work = self.work(counts, positions)
+        total = sum(work)
+        if total == 0:
+            return 1.0
+        return float(max(work)) * self.partCount / total
+
+# Imbalance statistics of one decomposition over time
+class ImbalanceTrace:
+    decomp = None
+    values = []
+    steps = []
+
+    def __init__(self, decomp):
+        self.decomp = decomp
+        self.values = []
+        self.steps = []
+
+    def add(self, step, counts, positions = None):
+        val = self.decomp.imbalance(counts, positions)
+        self.steps.append(step)
+        self.values.append(val)
+        return val
+
+    def mean(self):
+        return sum(self.values) / len(self.values) if len(self.values) > 0 else 0.0
+
+    # (value, step) of worst imbalance
+    def worst(self):
+        if len(self.values) == 0:
+            return (0.0, 0)
+        idx = self.values.index(max(self.values))
+        return (self.values[idx], self.steps[idx])
+
+    def last(self):
+        return self.values[-1] if len(self.values) > 0 else 0.0
+
+# Generate (step, counts, positions) by simulating
+def simulatedFrames(g, rfname, seed, update, stepCount):
+    s = sim.CompactSimulator(g, outFile = open(os.devnull, "w"))
+    if not s.loadRats(rfname, seed):
+        return
+    positions = s.positionView()
+    for (t, counts) in s.steps(stepCount, update):
+        yield (t, counts, positions)
+
+# Generate (step, counts, None) from driver output.  Frames without counts are skipped.
+# Sets ok to False in status if input invalid
+def drivenFrames(reader, nodeCount, status):
+    step = 0
+    counts = None
+    for line in reader:
+        tokens = line.split()
+        if counts is None:
+            if len(tokens) > 0 and tokens[0][0] == '#':
+                continue
+            if len(tokens) >= 1 and tokens[0] == "DONE":
+                return
+            if len(tokens) != 3 or tokens[0] != "STEP":
+                sys.stderr.write("Invalid driver input at step %d.  Line contents '%s'\n" % (step, line.strip()))
+                status['ok'] = False
+                return
+            if int(tokens[1]) != nodeCount:
+                sys.stderr.write("Driver has %d nodes, but graph has %d\n" % (int(tokens[1]), nodeCount))
+                status['ok'] = False
+                return
+            counts = []
+        elif len(tokens) == 1 and tokens[0] == "END":
+            if len(counts) == nodeCount:
+                yield (step, counts, None)
+            elif len(counts) > 0:
+                sys.stderr.write("Driver gave %d counts at step %d.  Expected %d\n" % (len(counts), step, nodeCount))
+                status['ok'] = False
+                return
+            step += 1
+            counts = None
+        else:
+            try:
+                counts.append(int(tokens[0]))
+            except Exception as e:
+                sys.stderr.write("Invalid count at step %d: %s.  Line contents '%s'\n" % (step, e, line.strip()))
+                status['ok'] = False
+                return
+
+def parseList(val):
+    return [v for v in val.split(',') if v != ""]
+
+def run(name, args):
+    gfname = ""
+    rfname = ""
+    ifname = None
+    stepCount = defaultSteps
+    seed = rutil.DEFAULTSEED
+    update = sim.UpdateMode.batch
+    parts = defaultParts
+    decomps = defaultDecomps
+    interval = 0
+    decompsGiven = False
+    pfnames = []
+    optlist, args = getopt.getopt(args, "hg:r:I:n:s:u:p:d:P:i:")
+    for (opt, val) in optlist:
+        if opt == '-h':
+            usage(name)
+        elif opt == '-g':
+            gfname = val
+        elif opt == '-r':
+            rfname = val
+        elif opt == '-I':
+            ifname = val
+        elif opt == '-n':
+            stepCount = int(val)
+        elif opt == '-s':
+            seed = int(val)
+        elif opt == '-u':
+            if val not in updateModes:
+                print "Error.  Unrecognized update mode '%s'" % val
+                usage(name)
+            update = updateModes[val]
+        elif opt == '-p':
+            parts = [int(v) for v in parseList(val)]
+        elif opt == '-d':
+            decomps = parseList(val)
+            decompsGiven = True
+        elif opt == '-P':
+            pfnames.append(val)
+        elif opt == '-i':
+            interval = int(val)
+    if gfname == "" or (rfname == "") == (ifname is None):
+        print "Error.  Need graph file, and either rat file or driver input"
+        usage(name)
+    for d in decomps:
+        if d not in decompositionNames:
+            print "Error.  Unrecognized decomposition '%s'" % d
+            usage(name)
+    if ifname is not None and 'r' in decomps:
+        if decompsGiven:
+            print "Error.  Rat chunk decomposition requires rat positions, which driver output doesn't provide"
+            usage(name)
+        decomps = [d for d in decomps if d != 'r']
+    if len(parts) == 0 or min(parts) < 1:
+        print "Error.  Invalid partition counts"
+        usage(name)
+    g = gengraph.Graph()
+    if not g.load(gfname):
+        return False
+    degrees = g.degreeList()
+    traces = [ImbalanceTrace(Decomposition(d, p, degrees)) for d in decomps for p in parts]
+    for pfname in pfnames:
+        pinfo = partition.load(pfname, g.nodeCount)
+        if pinfo is None:
+            return False
+        nodePartition, partCount = pinfo
+        traces.append(ImbalanceTrace(Decomposition(os.path.basename(pfname), partCount, degrees, nodePartition)))
+    status = {'ok' : True}
+    if ifname is None:
+        frames = simulatedFrames(g, rfname, seed, update, stepCount)
+    else:
+        try:
+            reader = streamio.openInput("" if ifname == "-" else ifname)
+        except Exception as e:
+            print "Error.  Couldn't open driver input '%s': %s" % (ifname, e)
+            return False
+        frames = drivenFrames(reader, g.nodeCount, status)
+    if interval > 0:
+        print "\tstep\t" + "\t".join([t.decomp.label() for t in traces])
+        print "\t" + "--------" * (len(traces) + 1)
+    for (step, counts, positions) in frames:
+        vals = [t.add(step, counts, positions) for t in traces]
+        if interval > 0 and step % interval == 0:
+            print "\t%d\t" % step + "\t".join(["%.3f" % v for v in vals])
+    if not status['ok']:
+        return False
+    if len(traces) == 0 or len(traces[0].values) == 0:
+        print "Error.  No steps with rat counts"
+        return False
+    print "Imbalance (max/mean partition work) over %d steps" % len(traces[0].values)
+    print "\tdecomp\tparts\tmean\tworst\t@step\tfinal"
+    print "\t" + "--------" * 6
+    for t in traces:
+        wval, wstep = t.worst()
+        print "\t%s\t%d\t%.3f\t%.3f\t%d\t%.3f" % (t.decomp.name, t.decomp.partCount, t.mean(), wval, wstep, t.last())
+    return True
+
+if __name__ == "__main__":
+    if not run(sys.argv[0], sys.argv[1:]):
+        sys.exit(1)
@@ -0,0 +1,144 @@
+# Optional instrumentation for GraphRat simulator
+# Records time spent in each phase of every simulation step,
+# along with counts of weight evaluations and region scans
+
+import sys
+import time
+import timeit
+import json
+
+# Phases of simulation step
+# compute: Determine next move for rats
+# move:    Move rats to new nodes
+# output:  Generate driver output
+# render:  Update visualization
+phaseNames = ["compute", "move", "output", "render"]
+
+# Find monotonic, high-resolution clock.
+# Python 2 doesn't provide one, and so use clock_gettime via ctypes when possible
+def monotonicClock():
+    if hasattr(time, "perf_counter"):
+        return time.perf_counter
+    try:
+        import ctypes
+        import ctypes.util
+        class Timespec(ctypes.Structure):
+            _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+        # Value of CLOCK_MONOTONIC differs between platforms
+        if sys.platform.startswith("linux"):
+            clockId = 1
+        elif sys.platform == "darwin":
+            clockId = 6
+        else:
+            return timeit.default_timer
+        libName = ctypes.util.find_library("c")
+        lib = ctypes.CDLL(libName)
+        clock_gettime = lib.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+        ts = Timespec()
+        tsp = ctypes.pointer(ts)
+        if clock_gettime(clockId, tsp) != 0:
+            return timeit.default_timer
+        def clock():
+            clock_gettime(clockId, tsp)
+            return ts.tv_sec + 1e-9 * ts.tv_nsec
+        return clock
+    except Exception:
+        return timeit.default_timer
+
+clock = monotonicClock()
+
+# Record for single simulation step
+class StepRecord:
+    step = 0
+    times = {}     # Seconds spent in each phase
+    weights = 0    # Number of weight evaluations
+    scans = 0      # Number of regions scanned
+
+    def __init__(self, step):
+        self.step = step
+        self.times = dict([(p, 0.0) for p in phaseNames])
+        self.weights = 0
+        self.scans = 0
+
+    def total(self):
+        return sum(self.times.values())
+
+    def toDict(self):
+        d = {"step" : self.step, "weights" : self.weights, "scans" : self.scans}
+        d.update(self.times)
+        return d
+
+class Profiler:
+    records = []
+    current = None
+    phase = None
+    tstart = 0.0
+
+    def __init__(self):
+        self.records = []
+        self.current = None
+        self.phase = None
+        self.tstart = 0.0
+
+    # Begin recording for step.  Step 0 covers output of initial state
+    def startStep(self, step):
+        self.current = StepRecord(step)
+        self.records.append(self.current)
+
+    def begin(self, phase):
+        self.phase = phase
+        self.tstart = clock()
+
+    def end(self):
+        self.current.times[self.phase] += clock() - self.tstart
+        self.phase = None
+
+    def count(self, weights, scans):
+        self.current.weights += weights
+        self.current.scans += scans
+
+    def totals(self):
+        t = StepRecord(-1)
+        for r in self.records:
+            for p in phaseNames:
+                t.times[p] += r.times[p]
+            t.weights += r.weights
+            t.scans += r.scans
+        return t
+
+    def writeTrace(self, f):
+        t = self.totals().toDict()
+        del t["step"]
+        trace = {"phases" : phaseNames,
+                 "steps" : [r.toDict() for r in self.records],
+                 "totals" : t}
+        json.dump(trace, f, indent = 1, sort_keys = True)
+        f.write("\n")
+
+    def writeSummary(self, f):
+        f.write("step\t" + "\t".join(["%s(ms)" % p for p in phaseNames]) + "\ttotal(ms)\tweights\tscans\n")
+        for r in self.records + [self.totals()]:
+            sstep = "total" if r.step < 0 else "%d" % r.step
+            fields = [sstep] + ["%.3f" % (1e3 * r.times[p]) for p in phaseNames]
+            fields += ["%.3f" % (1e3 * r.total()), "%d" % r.weights, "%d" % r.scans]
+            f.write("\t".join(fields) + "\n")
+
+    # Write results to file.  Name ending in ".json" gives JSON trace.
+    # Otherwise, give per-step summary.  Empty name or "-" indicates stderr
+    def store(self, fname = ""):
+        if fname in ["", "-"]:
+            f = sys.stderr
+        else:
+            try:
+                f = open(fname, "w")
+            except Exception as e:
+                sys.stderr.write("Couldn't open profile file '%s': %s\n" % (fname, e))
+                return False
+        if fname.endswith(".json"):
+            self.writeTrace(f)
+        else:
+            self.writeSummary(f)
+        if f is not sys.stderr:
+            f.close()
+        return True
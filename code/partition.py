@@ -0,0 +1,318 @@
+#!/usr/bin/python
+
+# Partitioning of graphs among workers, e.g., threads or nodes of a cluster.
+# Each method assigns every node to one of P partitions, optionally balancing
+# by node weight rather than node count.  With degree weighting, a node's weight
+# is the degree of its region (node plus neighbors), which is proportional to the
+# work of updating its rats when the rats are evenly spread.
+#
+# Metrics of a partitioning:
+#   Edge cut: Number of (undirected) edges between nodes in different partitions
+#   Halo:     For each partition, number of nodes outside it that are adjacent to one of its nodes.
+#             These are the nodes whose counts a worker must obtain from others on each step
+#   Balance:  Maximum partition weight divided by mean partition weight
+#
+# PARTITION FILES
+# First line of form "N P" where N is number of nodes and P is number of partitions
+# Remaining lines of form "I", giving partition of each successive node.
+# I must be between 0 and P-1.  Lines beginning with '#' are ignored
+#
+# When run as a program, partitions graph and reports metrics for one or more methods
+
+import sys
+import getopt
+import heapq
+
+import gengraph
+
+def usage(name):
+    print "Usage: %s [-h] -g GFILE [-m METHODS] [-p PARTS] [-w] [-o OFILE]" % name
+    print "    -h         Print this message"
+    print "    -g GFILE   Graph file"
+    print "    -m METHODS Comma-separated partitioning methods (default = %s):" % ",".join(PartitionMethod.methodNames)
+    for m in PartitionMethod.methodNames:
+        print "               %s: %s" % (m, PartitionMethod.methodDescriptions[PartitionMethod().parse(m)])
+    print "    -p PARTS   Comma-separated partition counts (default = %s)" % ",".join([str(p) for p in defaultParts])
+    print "    -w         Balance by region degree rather than node count"
+    print "    -o OFILE   Write partition file (requires single method and partition count)"
+    sys.exit(0)
+
+defaultParts = [4, 16]
+
+class PartitionMethod:
+    # strip:  Consecutive nodes in row-major order
+    # block:  Rectangular blocks of grid
+    # bfs:    Grow each partition breadth-first from unassigned node
+    # greedy: Grow each partition by adding frontier node with most edges into partition
+    (strip, block, bfs, greedy) = range(4)
+    methodNames = ["strip", "block", "bfs", "greedy"]
+    methodDescriptions = ["Strips of consecutive nodes in row-major order",
+                          "Rectangular blocks of grid",
+                          "Grown breadth-first",
+                          "Grown greedily, minimizing edge cut"]
+
+    def parse(self, name):
+        if name in self.methodNames:
+            return self.methodNames.index(name)
+        return -1
+
+# Weight of each node
+def nodeWeights(g, degreeWeighted = False):
+    if degreeWeighted:
+        return g.degreeList()
+    return [1] * g.nodeCount
+
+# Divide sequence of weights into partCount consecutive ranges of near-equal total weight.
+# Returns list giving range of each element
+def splitWeights(weights, partCount):
+    total = sum(weights)
+    result = []
+    upto = 0
+    for w in weights:
+        # Assign element according to midpoint of its weight
+        p = ((2 * upto + w) * partCount) / (2 * total) if total > 0 else 0
+        result.append(min(p, partCount-1))
+        upto += w
+    return result
+
+def stripPartition(g, partCount, weights):
+    return splitWeights(weights, partCount)
+
+# Factor partCount as rows x columns, as close to square as possible
+def gridShape(partCount):
+    rows = 1
+    for r in range(1, partCount+1):
+        if r * r > partCount:
+            break
+        if partCount % r == 0:
+            rows = r
+    return (rows, partCount / rows)
+
+def blockPartition(g, partCount, weights):
+    k = g.k
+    prows, pcols = gridShape(partCount)
+    # Split columns into column groups, and then rows of each group into blocks
+    colWeights = [sum([weights[g.id(r, c)] for r in range(k)]) for c in range(k)]
+    colGroup = splitWeights(colWeights, pcols)
+    result = [0] * g.nodeCount
+    for grp in range(pcols):
+        cols = [c for c in range(k) if colGroup[c] == grp]
+        rowWeights = [sum([weights[g.id(r, c)] for c in cols]) for r in range(k)]
+        rowGroup = splitWeights(rowWeights, prows)
+        for r in range(k):
+            for c in cols:
+                result[g.id(r, c)] = grp * prows + rowGroup[r]
+    return result
+
+# Grow partitions one at a time, each to its share of remaining weight.
+# Frontier nodes are chosen breadth-first, or by greatest gain:
+# (edges into partition) - (edges to unassigned nodes), which keeps the cut small
+def growPartition(g, partCount, weights, greedy = False):
+    adj = g.adjacency()
+    result = [-1] * g.nodeCount
+    remaining = sum(weights)
+    nextStart = 0
+    for p in range(partCount):
+        target = float(remaining) / (partCount - p)
+        if p == partCount-1:
+            # Last partition takes everything left
+            target = remaining
+        pweight = 0
+        gain = {}
+        frontier = []
+        head = 0
+        while pweight < target:
+            # Select next node
+            nid = -1
+            if greedy:
+                while len(frontier) > 0:
+                    negGain, cand = heapq.heappop(frontier)
+                    if result[cand] == -1 and -negGain == gain[cand]:
+                        nid = cand
+                        break
+            else:
+                while head < len(frontier):
+                    cand = frontier[head]
+                    head += 1
+                    if result[cand] == -1:
+                        nid = cand
+                        break
+            if nid == -1:
+                # Frontier exhausted.  Start from lowest unassigned node
+                while nextStart < g.nodeCount and result[nextStart] != -1:
+                    nextStart += 1
+                if nextStart == g.nodeCount:
+                    break
+                nid = nextStart
+            # Stop short rather than overshoot by more than half of node's weight
+            if pweight > 0 and p < partCount-1 and pweight + weights[nid] - target > target - pweight:
+                break
+            result[nid] = p
+            pweight += weights[nid]
+            for nbr in adj[nid]:
+                if result[nbr] != -1:
+                    continue
+                if greedy:
+                    if nbr not in gain:
+                        gain[nbr] = 1 - len([x for x in adj[nbr] if result[x] == -1])
+                    else:
+                        # Edge to nid now counts as internal rather than unassigned
+                        gain[nbr] += 2
+                    heapq.heappush(frontier, (-gain[nbr], nbr))
+                elif nbr not in gain:
+                    gain[nbr] = True
+                    frontier.append(nbr)
+        remaining -= pweight
+    return result
+
+# Partition graph.  Returns list giving partition of each node, or None if method can't be applied
+def partitionGraph(g, partCount, method = PartitionMethod.strip, degreeWeighted = False):
+    weights = nodeWeights(g, degreeWeighted)
+    if method == PartitionMethod.strip:
+        return stripPartition(g, partCount, weights)
+    elif method == PartitionMethod.block:
+        if g.k * g.k != g.nodeCount:
+            sys.stderr.write("Error.  Block partitioning requires square grid.  Graph has %d nodes\n" % g.nodeCount)
+            return None
+        return blockPartition(g, partCount, weights)
+    elif method == PartitionMethod.bfs:
+        return growPartition(g, partCount, weights, greedy = False)
+    elif method == PartitionMethod.greedy:
+        return growPartition(g, partCount, weights, greedy = True)
+    return None
+
+# Metrics of partitioning: (edge cut, list of halo sizes, list of partition weights)
+def partitionMetrics(g, partition, partCount, weights):
+    cut = 0
+    halo = [set() for p in range(partCount)]
+    for (i, j) in g.edges:
+        pi = partition[i]
+        pj = partition[j]
+        if pi != pj:
+            # Each edge appears in both directions
+            if i < j:
+                cut += 1
+            halo[pi].add(j)
+    pweights = [0] * partCount
+    for nid in range(g.nodeCount):
+        pweights[partition[nid]] += weights[nid]
+    return (cut, [len(h) for h in halo], pweights)
+
+def balance(pweights):
+    total = sum(pweights)
+    if total == 0:
+        return 1.0
+    return float(max(pweights)) * len(pweights) / total
+
+# Write partition file
+def store(partition, partCount, fname = "", commentList = []):
+    if fname == "":
+        f = sys.stdout
+    else:
+        try:
+            f = open(fname, "w")
+        except:
+            sys.stderr.write("Error.  Couldn't open file '%s' for writing\n" % (fname))
+            return False
+    f.write("%d %d\n" % (len(partition), partCount))
+    for c in commentList:
+        f.write(c + '\n')
+    f.write("".join(["%d\n" % p for p in partition]))
+    if fname != "":
+        f.close()
+    return True
+
+# Read partition file.  Returns (partition, partCount), or None if invalid.
+# When nodeCount > 0, file must have that number of nodes
+def load(fname, nodeCount = 0):
+    try:
+        f = open(fname, "r")
+    except:
+        sys.stderr.write("Could not open file '%s'\n" % fname)
+        return None
+    partition = []
+    partCount = 0
+    first = True
+    for line in f:
+        if line.strip() == "" or line.strip()[0] == '#':
+            continue
+        try:
+            if first:
+                ncount, partCount = map(int, line.split())
+                first = False
+            else:
+                partition.append(int(line.split()[0]))
+        except Exception as e:
+            sys.stderr.write("Error reading partition file '%s': %s.  Line contents '%s'\n" % (fname, e, line.strip()))
+            f.close()
+            return None
+    f.close()
+    if first:
+        sys.stderr.write("Error.  Partition file '%s' is empty\n" % fname)
+        return None
+    if len(partition) != ncount or (nodeCount > 0 and ncount != nodeCount):
+        sys.stderr.write("Error.  Partition file '%s' has %d entries.  Expected %d\n" % (fname, len(partition), nodeCount if nodeCount > 0 else ncount))
+        return None
+    if len(partition) > 0 and (min(partition) < 0 or max(partition) >= partCount):
+        sys.stderr.write("Error.  Partition file '%s' has partition numbers outside of range 0 to %d\n" % (fname, partCount-1))
+        return None
+    return (partition, partCount)
+
+def run(name, args):
+    gfname = ""
+    ofname = ""
+    methods = range(len(PartitionMethod.methodNames))
+    parts = defaultParts
+    degreeWeighted = False
+    pm = PartitionMethod()
+    optlist, args = getopt.getopt(args, "hg:m:p:wo:")
+    for (opt, val) in optlist:
+        if opt == '-h':
+            usage(name)
+        elif opt == '-g':
+            gfname = val
+        elif opt == '-m':
+            methods = [pm.parse(m) for m in val.split(',') if m != ""]
+            if -1 in methods:
+                print "Error.  Unrecognized partitioning method in '%s'" % val
+                usage(name)
+        elif opt == '-p':
+            parts = [int(p) for p in val.split(',') if p != ""]
+        elif opt == '-w':
+            degreeWeighted = True
+        elif opt == '-o':
+            ofname = val
+    if gfname == "":
+        print "Error.  Need graph file"
+        usage(name)
+    if len(parts) == 0 or min(parts) < 1:
+        print "Error.  Invalid partition counts"
+        usage(name)
+    if ofname != "" and (len(methods) != 1 or len(parts) != 1):
+        print "Error.  Can only write partition file for single method and partition count"
+        usage(name)
+    g = gengraph.Graph()
+    if not g.load(gfname):
+        return False
+    weights = nodeWeights(g, degreeWeighted)
+    print "Graph '%s': %d nodes, %d edges.  Weighted by %s" % (gfname, g.nodeCount, len(g.edges)/2, "region degree" if degreeWeighted else "node count")
+    print "\tmethod\tparts\tcut\thalo\tmaxhalo\tbalance"
+    print "\t" + "--------" * 6
+    ok = True
+    for m in methods:
+        for p in parts:
+            partition = partitionGraph(g, p, m, degreeWeighted)
+            if partition is None:
+                ok = False
+                continue
+            cut, halo, pweights = partitionMetrics(g, partition, p, weights)
+            print "\t%s\t%d\t%d\t%d\t%d\t%.3f" % (pm.methodNames[m], p, cut, sum(halo), max(halo), balance(pweights))
+            if ofname != "":
+                comments = ["# Graph %s, method = %s, weighted = %s" % (gfname, pm.methodNames[m], degreeWeighted)]
+                if not store(partition, p, ofname, comments):
+                    ok = False
+    return ok
+
+if __name__ == "__main__":
+    if not run(sys.argv[0], sys.argv[1:]):
+        sys.exit(1)
@@ -0,0 +1,335 @@
+#!/usr/bin/python
+
+# Microbenchmarks for the hot paths of the Python reference simulator
+# Times individual operations on the graphs and rat files in the data directory,
+# reporting the cost per operation and, where meaningful, per rat
+
+import sys
+import os
+import getopt
+import timeit
+import cStringIO
+
+import rutil
+import gengraph
+import sim
+import grun
+import streamio
+
+def usage(name):
+    print "Usage: %s [-h] [-k SIZES] [-g GTYPES] [-r RTYPE] [-b BENCHES] [-m SECS]" % name
+    print "(All lists given as colon-separated text.)"
+    print "    -h          Print this message"
+    print "    -k SIZES    Graph sizes (number of nodes).  Default = 64:400:1024"
+    print "    -g GTYPES   Graph types (u, t, f).  Default = u:t:f"
+    print "    -r RTYPE    Rat distribution (u, d, r).  Default = r"
+    print "    -b BENCHES  Benchmarks to run.  Default = all of:"
+    print "       " + ":".join(benchNames)
+    print "    -m SECS     Minimum measurement time for each benchmark.  Default = %.2f" % minTime
+    sys.exit(0)
+
+dataDir = "./data/"
+
+# Load factors of rat files provided in data directory, indexed by graph size
+loadFactors = {4 : 1, 64 : 5, 400 : 10, 1024 : 10, 25600 : 40}
+
+# Minimum time (in seconds) to spend repeating each measurement
+minTime = 0.5
+# Number of measurements.  Report the fastest
+repeatCount = 3
+
+# Marker that allows filtering via grep
+marker = "+++\t"
+nomarker = "\t"
+
+def outmsg(s):
+    if len(s) > 0 and s[-1] != '\n':
+        s += "\n"
+    sys.stdout.write(s)
+    sys.stdout.flush()
+
+def graphFileName(graphSize, graphType):
+    return dataDir + "g-" + graphType + str(graphSize) + ".gph"
+
+def ratFileName(graphSize, ratType):
+    load = loadFactors[graphSize] if graphSize in loadFactors else 1
+    return dataDir + "r-" + str(graphSize) + '-' + ratType + str(load) + ".rats"
+
+# Sink for stderr, so that status messages don't disturb measurements
+nullFile = open(os.devnull, "w")
+
+# Determine seconds per call of fn, taking best of repeatCount measurements
+# each of which runs for at least minTime seconds
+def timeCall(fn):
+    best = None
+    savedErr = sys.stderr
+    sys.stderr = nullFile
+    try:
+        for rep in range(repeatCount):
+            calls = 0
+            tstart = timeit.default_timer()
+            while True:
+                fn()
+                calls += 1
+                secs = timeit.default_timer() - tstart
+                if secs >= minTime:
+                    break
+            t = secs / calls
+            if best is None or t < best:
+                best = t
+    finally:
+        sys.stderr = savedErr
+    return best
+
+# Context shared by benchmarks for single graph/rat combination
+class Context:
+    graphSize = 0
+    graphType = 'u'
+    gfname = ""
+    rfname = ""
+    graph = None
+    sim = None
+
+    def __init__(self, graphSize, graphType, ratType):
+        self.graphSize = graphSize
+        self.graphType = graphType
+        self.gfname = graphFileName(graphSize, graphType)
+        self.rfname = ratFileName(graphSize, ratType)
+        self.graph = None
+        self.sim = None
+
+    def ok(self):
+        return self.loadGraph() is not None
+
+    def loadGraph(self):
+        if self.graph is None and os.path.exists(self.gfname):
+            g = gengraph.Graph()
+            savedErr = sys.stderr
+            sys.stderr = nullFile
+            if g.load(self.gfname):
+                self.graph = g
+            sys.stderr = savedErr
+        return self.graph
+
+    # Simulator with rats loaded.  None if no rat file available
+    def loadSim(self):
+        if self.sim is None and os.path.exists(self.rfname):
+            s = sim.Simulator(self.loadGraph(), outFile = nullFile)
+            savedErr = sys.stderr
+            sys.stderr = nullFile
+            if s.loadRats(self.rfname):
+                self.sim = s
+            sys.stderr = savedErr
+        return self.sim
+
+    # Discard simulator, so that next benchmark starts from initial rat positions
+    # rather than from state left by earlier benchmarks
+    def reset(self):
+        self.sim = None
+
+    # For each rat, list of loads in its region
+    def regionLoads(self):
+        s = self.loadSim()
+        return [[float(nd.ratCount)/s.loadFactor for nd in r.node.region] for r in s.rats]
+
+# Each benchmark function accepts a context and returns tuple (fn, ops, rats)
+# where fn performs ops operations on behalf of rats rats.
+# Returns None if benchmark can't be run on context
+
+def benchMweight(ctx):
+    if ctx.loadSim() is None:
+        return None
+    vals = [v for loads in ctx.regionLoads() for v in loads]
+    mweight = rutil.mweight
+    def fn():
+        for v in vals:
+            mweight(v)
+    return (fn, len(vals), ctx.sim.ratCount())
+
+def benchChooseMove(ctx):
+    if ctx.loadSim() is None:
+        return None
+    loadList = ctx.regionLoads()
+    rng = rutil.RNG([rutil.DEFAULTSEED])
+    chooseMove = rutil.chooseMove
+    def fn():
+        for loads in loadList:
+            chooseMove(rng, loads)
+    return (fn, len(loadList), ctx.sim.ratCount())
+
+def benchWeightedIndex(ctx):
+    if ctx.loadSim() is None:
+        return None
+    weightList = [[rutil.mweight(v) for v in loads] for loads in ctx.regionLoads()]
+    rng = rutil.RNG([rutil.DEFAULTSEED])
+    def fn():
+        for weights in weightList:
+            rng.weightedIndex(weights)
+    return (fn, len(weightList), ctx.sim.ratCount())
+
+def benchRatNext(ctx):
+    s = ctx.loadSim()
+    if s is None:
+        return None
+    rats = s.rats
+    loadFactor = s.loadFactor
+    def fn():
+        for r in rats:
+            r.next(loadFactor)
+    return (fn, len(rats), len(rats))
+
+def benchRatMove(ctx):
+    s = ctx.loadSim()
+    if s is None:
+        return None
+    rats = s.rats
+    for r in rats:
+        r.next(s.loadFactor)
+    targets = [r.newNode for r in rats]
+    pairs = zip(rats, targets)
+    def fn():
+        for (r, t) in pairs:
+            r.newNode = t
+            r.move()
+    return (fn, len(rats), len(rats))
+
+# Complete simulation step in batch mode.  Compact engine is given its own copy of the state
+def benchStep(ctx):
+    s = ctx.loadSim()
+    if s is None:
+        return None
+    s.updateMode = sim.UpdateMode.batch
+    bsize = s.updateBatchSize(sim.UpdateMode.batch)
+    def fn():
+        s.runStep(bsize)
+    return (fn, 1, s.ratCount())
+
+def benchCompactStep(ctx):
+    if ctx.loadSim() is None:
+        return None
+    s = sim.CompactSimulator(ctx.loadGraph(), outFile = nullFile)
+    savedErr = sys.stderr
+    sys.stderr = nullFile
+    s.loadRats(ctx.rfname)
+    sys.stderr = savedErr
+    s.updateMode = sim.UpdateMode.batch
+    bsize = s.updateBatchSize(sim.UpdateMode.batch)
+    def fn():
+        s.runStep(bsize)
+    return (fn, 1, s.ratCount())
+
+def benchGraphLoad(ctx):
+    gfname = ctx.gfname
+    def fn():
+        gengraph.Graph().load(gfname)
+    s = ctx.loadSim()
+    return (fn, 1, 0 if s is None else s.ratCount())
+
+def benchSimInit(ctx):
+    g = ctx.loadGraph()
+    def fn():
+        sim.Simulator(g, outFile = nullFile)
+    s = ctx.loadSim()
+    return (fn, 1, 0 if s is None else s.ratCount())
+
+def benchLoadRats(ctx):
+    if ctx.loadSim() is None:
+        return None
+    s = sim.Simulator(ctx.loadGraph(), outFile = nullFile)
+    rfname = ctx.rfname
+    def fn():
+        s.loadRats(rfname)
+    return (fn, 1, ctx.sim.ratCount())
+
+def benchDriveOut(ctx):
+    s = ctx.loadSim()
+    if s is None:
+        return None
+    def fn():
+        s.driveOut(f = nullFile)
+    return (fn, 1, s.ratCount())
+
+def benchLoadCounts(ctx):
+    s = ctx.loadSim()
+    if s is None:
+        return None
+    buf = cStringIO.StringIO()
+    s.driveOut(f = buf)
+    text = buf.getvalue()
+    ds = grun.DrivenSimulator(inFile = streamio.LineReader(cStringIO.StringIO(text)))
+    def fn():
+        ds.inFile = streamio.LineReader(cStringIO.StringIO(text))
+        ds.loadCounts()
+    return (fn, 1, s.ratCount())
+
+benchNames = ["mweight", "chooseMove", "weightedIndex", "next", "move", "step", "compactStep",
+              "load", "init", "loadRats", "driveOut", "loadCounts"]
+
+benchFunctions = {
+    "mweight" : benchMweight,
+    "chooseMove" : benchChooseMove,
+    "weightedIndex" : benchWeightedIndex,
+    "next" : benchRatNext,
+    "move" : benchRatMove,
+    "step" : benchStep,
+    "compactStep" : benchCompactStep,
+    "load" : benchGraphLoad,
+    "init" : benchSimInit,
+    "loadRats" : benchLoadRats,
+    "driveOut" : benchDriveOut,
+    "loadCounts" : benchLoadCounts,
+    }
+
+def runBench(name, ctx):
+    # Benchmarks such as next, move, and step change simulator state.  Start each from fresh simulator
+    ctx.reset()
+    setup = benchFunctions[name](ctx)
+    if setup is None:
+        outmsg(nomarker + "%s\t%s\t%d\tSkipped.  No rat file '%s'" % (name, ctx.graphType, ctx.graphSize, ctx.rfname))
+        return
+    (fn, ops, rats) = setup
+    secs = timeCall(fn)
+    usecOp = 1e6 * secs / ops
+    results = [name, ctx.graphType, "%d" % ctx.graphSize, "%d" % rats, "%d" % ops, "%10.3f" % usecOp]
+    if rats > 0:
+        results.append("%10.3f" % (1e6 * secs / rats))
+    outmsg(marker + "\t".join(results))
+
+def run(name, args):
+    global minTime
+    sizeList = [64, 400, 1024]
+    typeList = ['u', 't', 'f']
+    ratType = 'r'
+    benchList = benchNames
+    optlist, args = getopt.getopt(args, "hk:g:r:b:m:")
+    for (opt, val) in optlist:
+        if opt == '-h':
+            usage(name)
+        elif opt == '-k':
+            sizeList = [int(v) for v in val.split(":")]
+        elif opt == '-g':
+            typeList = val.split(":")
+        elif opt == '-r':
+            ratType = val
+        elif opt == '-b':
+            benchList = val.split(":")
+            for b in benchList:
+                if b not in benchFunctions:
+                    print "Unknown benchmark '%s'" % b
+                    usage(name)
+        elif opt == '-m':
+            minTime = float(val)
+    outmsg(nomarker + "op\tgtype\tnodes\trats\tops\tusec/op\t\tusec/rat")
+    outmsg(nomarker + "---------" * 8)
+    for graphSize in sizeList:
+        for graphType in typeList:
+            ctx = Context(graphSize, graphType, ratType)
+            if not ctx.ok():
+                outmsg(nomarker + "Skipping graph '%s'.  Couldn't load" % ctx.gfname)
+                continue
+            for b in benchList:
+                runBench(b, ctx)
+        outmsg(nomarker + "---------" * 8)
+
+if __name__ == "__main__":
+    run(sys.argv[0], sys.argv[1:])
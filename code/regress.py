@@ -8,14 +8,28 @@ import math
 import os
 import os.path
 import getopt
+import multiprocessing
+import hashlib
+import glob
+
+import gengraph
+import sim
+import streamio
+import datagen
+import cengine
 
 def usage(fname):
-    print "Usage: %s [-h] [-c] [-t THD] [-p PCS]" % fname
+    print "Usage: %s [-h] [-c] [-t THD] [-j JOBS] [-a] [-l]" % fname
     print "    -h       Print this message"
     print "    -c       Clear expected result cache"
     print "    -t THD   Specify number of OMP threads"
     print "       If > 1, will run crun-omp.  Else will run crun"
+    print "    -j JOBS  Run up to JOBS regression cases concurrently (default = number of cores / THD)"
+    print "       If = 1, run cases serially in list order"
     print "    -a       Run ALL tests, including for big graphs"
+    print "    -l       Step C simulator in process, through shared library (make lib), alongside"
+    print "       reference Python simulator, comparing node counts after every step"
+    print "    Missing graph and rat files are generated and cached in %s" % (dataDir + datagen.cacheSubdirectory)
     sys.exit(0)
 
 
@@ -23,6 +37,8 @@ def usage(fname):
 
 # Gold-standard reference program
 standardProg = "./grun.py"
+# Source files that determine the reference simulator's results
+standardSources = ["./sim.py", "./rutil.py", "./gengraph.py"]
 
 # Simulator being tested
 testProg = "./crun"
@@ -38,6 +54,12 @@ cacheDir = "./regression-cache/"
 # Limit on how many mismatches get reported
 mismatchLimit = 5
 
+# Compare simulators in process rather than through their output
+inProcess = False
+
+# Number of hex digits of content hash included in reference file names
+keyDigits = 16
+
 # Series of tests to perform.
 # Each defined by:
 #  number of nodes
@@ -73,14 +95,49 @@ extraRegressionList = [
 def regressionName(params, standard = True):
     return ("ref" if standard else "tst") +  "-%.3d-%s-%s-%.3d-%.3d-%s-%.2d.txt" % params
 
-def regressionCommand(params, standard = True, threadCount = 1):    
+# Graph and rat files used by test case
+def inputFiles(params):
     graphSize, graphType, ratType, ratLoad, stepCount, updateFlag, seed = params
+    graphFileName = datagen.graphPath(dataDir, graphSize, graphType)
+    ratFileName = datagen.ratPath(dataDir, graphSize, ratType, ratLoad)
+    return (graphFileName, ratFileName)
 
-    sizeName = str(graphSize)
+# Content hashes of files, indexed by file name
+fileHashCache = {}
 
-    graphFileName = dataDir + "g-" + graphType + sizeName + ".gph"
+def fileHash(fname):
+    if fname not in fileHashCache:
+        h = hashlib.sha1()
+        try:
+            f = open(fname, 'rb')
+            while True:
+                buf = f.read(1 << 20)
+                if buf == "":
+                    break
+                h.update(buf)
+            f.close()
+        except IOError:
+            h.update("MISSING")
+        fileHashCache[fname] = h.hexdigest()
+    return fileHashCache[fname]
+
+# Key identifying reference result.
+# Changes whenever the reference sources, the input files, or the test parameters change
+def referenceKey(params):
+    graphFileName, ratFileName = inputFiles(params)
+    h = hashlib.sha1()
+    for fname in standardSources + [graphFileName, ratFileName]:
+        h.update(fileHash(fname))
+    h.update(repr(params))
+    return h.hexdigest()[:keyDigits]
+
+def referenceName(params):
+    return regressionName(params, standard = True)[:-len(".txt")] + "-" + referenceKey(params) + ".txt"
 
-    ratFileName = dataDir + "r-" + sizeName + '-' + ratType + str(ratLoad) + ".rats"
+def regressionCommand(params, standard = True, threadCount = 1):    
+    graphSize, graphType, ratType, ratLoad, stepCount, updateFlag, seed = params
+
+    graphFileName, ratFileName = inputFiles(params)
 
     prog = ''
     prelist = []
@@ -123,16 +180,63 @@ def runSim(params, standard = True, threadCount = 1):
         return False
     return True
 
+# Loaded graphs, indexed by graph file name.
+# Shared by all reference runs that use the same graph
+graphCache = {}
+
+def loadGraph(fname):
+    if fname not in graphCache:
+        g = gengraph.Graph()
+        if not g.load(fname):
+            return None
+        graphCache[fname] = g
+    return graphCache[fname]
+
+updateModes = {'s' : sim.UpdateMode.synchronous, 'r' : sim.UpdateMode.ratOrder, 'b' : sim.UpdateMode.batch}
+
+# Generate reference result by running Python simulator in this process.
+# Output is identical to that of running standardProg in drive mode
+def runReference(params):
+    graphSize, graphType, ratType, ratLoad, stepCount, updateFlag, seed = params
+    graphFileName, ratFileName = inputFiles(params)
+    rname = referenceName(params)
+    pname = cacheDir + rname
+    # Write to temporary file, so that concurrent or interrupted runs never leave partial reference
+    tname = pname + ".%d.tmp" % os.getpid()
+    try:
+        outFile = open(tname, 'w')
+    except Exception as e:
+        sys.stderr.write("Couldn't open file '%s' to write.  %s\n" % (tname, e))
+        return False
+    sys.stderr.write("Generating reference %s\n" % rname)
+    ok = False
+    g = loadGraph(graphFileName)
+    if g is not None:
+        s = sim.Simulator(g, outFile = outFile)
+        if s.loadRats(ratFileName, seed):
+            s.simulate(stepCount, update = updateModes[updateFlag])
+            ok = True
+    outFile.close()
+    if not ok:
+        sys.stderr.write("Couldn't generate reference %s\n" % rname)
+        os.remove(tname)
+        return False
+    # Remove references made with earlier versions of sources or inputs
+    for oldName in glob.glob(cacheDir + regressionName(params, standard = True)[:-len(".txt")] + "-*.txt"):
+        os.remove(oldName)
+    os.rename(tname, pname)
+    return True
+
 def checkFiles(refPath, testPath):
     badLines = 0
     lineNumber = 0
     try:
-        rf = open(refPath, 'r')
+        rf = streamio.openInput(refPath)
     except:
-        sys.sterr.write("Couldn't open reference file '%s'\n" % refPath);
+        sys.stderr.write("Couldn't open reference file '%s'\n" % refPath);
         return False
     try:
-        tf = open(testPath, 'r')
+        tf = streamio.openInput(testPath)
     except:
         sys.stderr.write("Couldn't open test file '%s'\n" % testPath);
         return False
@@ -165,10 +269,56 @@ def checkFiles(refPath, testPath):
         sys.stderr.write("%d total mismatches.  Files %s, %s\n" % (badLines, refPath, testPath))
     return badLines == 0
             
+# Compare counts of reference and test simulators
+def checkCounts(stepNumber, refCounts, testCounts):
+    badNodes = 0
+    for nid in xrange(len(refCounts)):
+        if refCounts[nid] != testCounts[nid]:
+            badNodes += 1
+            if badNodes <= mismatchLimit:
+                sys.stderr.write("Mismatch at step %d, node %d.  Reference count %d.  Test count %d\n" %
+                                 (stepNumber, nid, refCounts[nid], testCounts[nid]))
+    if badNodes > 0:
+        sys.stderr.write("%d total mismatches at step %d\n" % (badNodes, stepNumber))
+    return badNodes == 0
+
+# Step C simulator (through shared library) and reference Python simulator together in this process
+def regressInProcess(params, threadCount):
+    graphSize, graphType, ratType, ratLoad, stepCount, updateFlag, seed = params
+    graphFileName, ratFileName = inputFiles(params)
+    sys.stderr.write("Comparing engines on %s\n" % regressionName(params, standard = False))
+    try:
+        engine = cengine.Engine(graphFileName, ratFileName, seed, threadCount)
+    except Exception as e:
+        sys.stderr.write("Couldn't run C engine: %s\n" % e)
+        return False
+    g = loadGraph(graphFileName)
+    if g is None:
+        engine.close()
+        return False
+    # Compare against reference simulator.  Stepping generates no output, so no output file needed
+    s = sim.Simulator(g)
+    if not s.loadRats(ratFileName, seed):
+        engine.close()
+        return False
+    update = updateModes[updateFlag]
+    ok = True
+    # Python simulator advances as each step is requested, and so step C engine in lockstep
+    for (stepNumber, counts) in s.steps(stepCount, update):
+        if stepNumber > 0:
+            engine.step(update)
+        ok = checkCounts(stepNumber, counts, engine.ratCount)
+        if not ok:
+            break
+    engine.close()
+    return ok
+
 def regress(params, threadCount):
-    refPath = cacheDir + regressionName(params, standard = True)
+    if inProcess:
+        return regressInProcess(params, threadCount)
+    refPath = referencePath(params)
     if not os.path.exists(refPath):
-        if not runSim(params, standard = True):
+        if not runReference(params):
             sys.stderr.write("Failed to run simulation with reference simulator\n")
             return False
 
@@ -180,7 +330,59 @@ def regress(params, threadCount):
 
     return checkFiles(refPath, testPath)
 
-def run(flushCache, threadCount, doAll):
+# Name of reference file for test case
+def referencePath(params):
+    return cacheDir + referenceName(params)
+
+# Rough estimate of how long a case takes with the reference simulator
+def caseCost(params):
+    graphSize, graphType, ratType, ratLoad, stepCount, updateFlag, seed = params
+    return graphSize * ratLoad * stepCount
+
+# Order cases for concurrent execution.
+# Cases that must first generate a reference result are scheduled ahead
+# of those whose reference is cached, and within each group the most
+# expensive cases start first, so the slowest case bounds the total time.
+def scheduleCases(rlist):
+    needRef = [p for p in rlist if not os.path.exists(referencePath(p))]
+    haveRef = [p for p in rlist if os.path.exists(referencePath(p))]
+    needRef.sort(key = caseCost, reverse = True)
+    haveRef.sort(key = caseCost, reverse = True)
+    return needRef + haveRef
+
+# Worker function for process pool.  Must be at top level so that it can be pickled
+def regressCase(args):
+    params, threadCount = args
+    try:
+        return (params, regress(params, threadCount))
+    except Exception as e:
+        sys.stderr.write("Regression %s raised exception: %s\n" % (regressionName(params, standard = False), e))
+        return (params, False)
+
+# Generate (params, passed) for each case as it completes
+def runCases(rlist, threadCount, jobCount):
+    if jobCount <= 1 or len(rlist) <= 1:
+        for p in rlist:
+            yield (p, regress(p, threadCount))
+        return
+    # Load graphs needed for reference runs before forking workers,
+    # so that all workers share a single copy of each
+    for p in rlist:
+        if inProcess or not os.path.exists(referencePath(p)):
+            loadGraph(inputFiles(p)[0])
+    pool = multiprocessing.Pool(min(jobCount, len(rlist)))
+    try:
+        # Hand out cases one at a time, so that idle workers pick up the next in schedule order
+        for result in pool.imap_unordered(regressCase, [(p, threadCount) for p in scheduleCases(rlist)], 1):
+            yield result
+    except:
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+
+def run(flushCache, threadCount, doAll, jobCount = 1):
 
     if flushCache and os.path.exists(cacheDir):
         try:
@@ -197,9 +399,12 @@ def run(flushCache, threadCount, doAll):
     goodCount = 0
     allCount = 0
     rlist = regressionList + (extraRegressionList if doAll else [])
-    for p in rlist:
+    graphs = [(p[0], p[1]) for p in rlist]
+    rats = [(p[0], p[2], p[3]) for p in rlist]
+    datagen.ensureInputs(dataDir, graphs, rats, jobCount)
+    for (p, passed) in runCases(rlist, threadCount, jobCount):
         allCount += 1
-        if regress(p, threadCount):
+        if passed:
             sys.stderr.write("Regression %s passed\n" % regressionName(p, standard = False))
             goodCount += 1
     totalCount = len(rlist)
@@ -211,8 +416,9 @@ if __name__ == "__main__":
     doAll = False
     threadCount = 1
     flushCache = False
+    jobCount = 0
     
-    optlist, args = getopt.getopt(sys.argv[1:], "hct:a")
+    optlist, args = getopt.getopt(sys.argv[1:], "hct:j:al")
 
 
     for (opt, val) in optlist:
@@ -222,6 +428,13 @@ if __name__ == "__main__":
             flushCache = True
         elif opt == '-t':
             threadCount = int(val)
+        elif opt == '-j':
+            jobCount = int(val)
         elif opt == '-a':
             doAll = True
-    run(flushCache, threadCount, doAll)
+        elif opt == '-l':
+            inProcess = True
+    if jobCount <= 0:
+        # Each case can run threadCount OMP threads.  Don't oversubscribe cores
+        jobCount = max(multiprocessing.cpu_count() / max(threadCount, 1), 1)
+    run(flushCache, threadCount, doAll, jobCount)
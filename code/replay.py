@@ -0,0 +1,193 @@
+#!/usr/bin/python
+
+# Random access to recorded driver output.
+# A sidecar index file (FILE.idx) gives the byte offset of the STEP line
+# beginning each frame, so that any step can be loaded by parsing only
+# its frame.  The index is built in a single pass over the file, either when
+# the file is first opened for replay, or while it is being recorded.
+#
+# Index file format (line oriented, lines beginning with '#' ignored):
+#   First line of form "S F", where S is size of indexed file in bytes and F is number of frames
+#   Remaining lines give offset of each successive frame
+#
+# When run as a program, builds (or rebuilds) indexes for the listed files
+
+import sys
+import os
+import getopt
+import cStringIO
+
+import streamio
+
+def usage(name):
+    print "Usage: %s [-h] [-f] FILE ..." % name
+    print "    -h       Print this message"
+    print "    -f       Rebuild index even if up to date"
+    print "    FILE     Recorded (uncompressed) driver output"
+    sys.exit(0)
+
+def indexName(fname):
+    return fname + ".idx"
+
+# Locates frame headers in stream presented as successive chunks of data.
+# Only lines beginning with "STEP" are of interest, and these are rare,
+# and so search for them directly rather than splitting into lines
+class StepScanner:
+    offsets = []    # Offsets of frame headers found so far
+    offset = 0      # Number of bytes scanned
+    tail = ""       # End of previous chunk, in case header split between chunks
+
+    def __init__(self):
+        self.offsets = []
+        self.offset = 0
+        # Start of stream counts as start of line
+        self.tail = "\n"
+
+    def scan(self, data):
+        text = self.tail + data
+        base = self.offset - len(self.tail)
+        pos = text.find("\nSTEP")
+        while pos >= 0:
+            self.offsets.append(base + pos + 1)
+            pos = text.find("\nSTEP", pos + 1)
+        # Any match must include at least one new byte, and so matches aren't repeated
+        self.tail = text[-4:]
+        self.offset += len(data)
+
+# File-like object that records frame offsets of data written through it,
+# and stores index when closed
+class IndexRecorder:
+    file = None
+    fname = ""
+    scanner = None
+
+    def __init__(self, f, fname):
+        self.file = f
+        self.fname = fname
+        self.scanner = StepScanner()
+
+    def write(self, data):
+        self.scanner.scan(data)
+        self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        storeIndex(self.fname, self.scanner.offset, self.scanner.offsets)
+
+# Open uncompressed output file, recording index as it is written
+def openRecording(fname, depth = streamio.defaultDepth):
+    f = open(fname, "wb")
+    return streamio.AsyncWriter(IndexRecorder(f, fname), depth = depth)
+
+def storeIndex(fname, size, offsets):
+    iname = indexName(fname)
+    try:
+        f = open(iname, "w")
+        f.write("%d %d\n" % (size, len(offsets)))
+        f.write("".join(["%d\n" % off for off in offsets]))
+        f.close()
+    except Exception as e:
+        sys.stderr.write("Couldn't write index file '%s': %s\n" % (iname, e))
+        return False
+    return True
+
+# Read index file.  Returns list of offsets, or None if index missing or out of date
+def loadIndex(fname):
+    iname = indexName(fname)
+    try:
+        if os.path.getmtime(iname) < os.path.getmtime(fname):
+            return None
+        f = open(iname, "r")
+    except Exception:
+        return None
+    lines = [line for line in f if line.strip() != "" and line.strip()[0] != '#']
+    f.close()
+    try:
+        size, count = map(int, lines[0].split())
+        offsets = map(int, lines[1:])
+    except Exception:
+        return None
+    if size != os.path.getsize(fname) or count != len(offsets):
+        return None
+    return offsets
+
+# Scan file and store index.  Returns list of offsets
+def buildIndex(fname):
+    scanner = StepScanner()
+    f = open(fname, "rb")
+    while True:
+        data = f.read(streamio.chunkSize)
+        if data == "":
+            break
+        scanner.scan(data)
+    f.close()
+    storeIndex(fname, scanner.offset, scanner.offsets)
+    return scanner.offsets
+
+# Recorded driver output, supporting access to individual frames
+class FrameFile:
+    fname = ""
+    file = None
+    offsets = []
+    size = 0
+
+    # Raises IOError if file can't be opened or is compressed
+    def __init__(self, fname, rebuild = False):
+        self.fname = fname
+        self.file = open(fname, "rb")
+        magic = self.file.read(streamio.Compression.magicLength)
+        if streamio.Compression().fromMagic(magic) != streamio.Compression.none:
+            self.file.close()
+            raise IOError("Can't seek within compressed file.  Decompress it first")
+        self.size = os.path.getsize(fname)
+        self.offsets = None if rebuild else loadIndex(fname)
+        if self.offsets is None:
+            self.offsets = buildIndex(fname)
+
+    def frameCount(self):
+        return len(self.offsets)
+
+    # Text of frame, including STEP and END lines
+    def frameText(self, step):
+        start = self.offsets[step]
+        end = self.offsets[step+1] if step+1 < len(self.offsets) else self.size
+        self.file.seek(start)
+        return self.file.read(end - start)
+
+    # Line iterator over frame, in form accepted by DrivenSimulator
+    def frameReader(self, step):
+        return streamio.LineReader(cStringIO.StringIO(self.frameText(step)))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def run(name, args):
+    rebuild = False
+    optlist, args = getopt.getopt(args, "hf")
+    for (opt, val) in optlist:
+        if opt == '-h':
+            usage(name)
+        elif opt == '-f':
+            rebuild = True
+    if len(args) == 0:
+        usage(name)
+    ok = True
+    for fname in args:
+        try:
+            frames = FrameFile(fname, rebuild)
+        except Exception as e:
+            print "Error.  Couldn't index '%s': %s" % (fname, e)
+            ok = False
+            continue
+        print "File '%s': %d frames.  Index in '%s'" % (fname, frames.frameCount(), indexName(fname))
+        frames.close()
+    return ok
+
+if __name__ == "__main__":
+    if not run(sys.argv[0], sys.argv[1:]):
+        sys.exit(1)
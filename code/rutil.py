@@ -88,9 +88,8 @@ class RNG:
     # Return list containing all elements of seq in random order
     # Much faster than using sample()
     def permute(self, seq):
-        importSpecial()
         n = len(seq)
-        a = np.array(range(n))
+        a = range(n)
         while (n > 1):
             idx = self.randInt(0, n-1)
             a[idx], a[n-1] = a[n-1], a[idx]
@@ -130,3 +129,39 @@ def mweight(val):
 def chooseMove(rng, vals):
     weights = [mweight(l) for l in vals]
     return rng.weightedIndex(weights)
+
+# Table for choosing index according to fixed set of weights in constant time,
+# using Walker's alias method (as formulated by Vose).
+# Gives same distribution as RNG.weightedIndex, but not the same choices
+class AliasTable:
+    prob = []   # Probability of keeping each index
+    alias = []  # Alternative index for each index
+
+    def __init__(self, weights):
+        n = len(weights)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        self.prob = [1.0] * n
+        self.alias = range(n)
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while len(small) > 0 and len(large) > 0:
+            s = small.pop()
+            l = large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # Any remaining entries have probability 1.0 (up to rounding)
+
+    # Choose index, using single random number
+    def sample(self, rng):
+        n = len(self.prob)
+        val = rng.randFloat(n)
+        idx = min(int(val), n-1)
+        if val - idx < self.prob[idx]:
+            return idx
+        return self.alias[idx]
@@ -112,27 +112,40 @@ static void run_step(state_t *s, int batch_size) {
 	process_batch(s, b, bcount);
     }
 }
-void simulate(state_t *s, int count, update_t update_mode, int dinterval, bool display) {
-    int i;
-    /* Compute and show initial state */
-    bool show_counts = true;
-    take_census(s);
-    int batch_size;
+/* Number of rats to process between updates for given update mode */
+static int update_batch_size(state_t *s, update_t update_mode) {
     switch(update_mode) {
     case UPDATE_SYNCHRONOUS:
-	batch_size = s->nrat;
-	break;
+	return s->nrat;
     case UPDATE_RAT:
-	batch_size = 1;
-	break;
+	return 1;
     case UPDATE_BATCH:
-	batch_size = s->batch_size;
-	break;
+	return s->batch_size;
     default:
 	outmsg("WARNING: Unknown update mode.  Using batch mode\n");
-	batch_size = s->batch_size;
-	break;
+	return s->batch_size;
     }
+}
+
+/* Prepare state for stepping.  Must be called before first call to simulate_steps */
+void init_simulation(state_t *s) {
+    take_census(s);
+}
+
+/* Run count simulation steps without generating output */
+void simulate_steps(state_t *s, int count, update_t update_mode) {
+    int i;
+    int batch_size = update_batch_size(s, update_mode);
+    for (i = 0; i < count; i++)
+	run_step(s, batch_size);
+}
+
+void simulate(state_t *s, int count, update_t update_mode, int dinterval, bool display) {
+    int i;
+    /* Compute and show initial state */
+    bool show_counts = true;
+    take_census(s);
+    int batch_size = update_batch_size(s, update_mode);
     if (display)
 	show(s, show_counts);
     for (i = 0; i < count; i++) {
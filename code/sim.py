@@ -4,19 +4,69 @@
 # This file contains the core simulation modeling code
 
 import sys
+import time
 import datetime
 import math
 import string
+import struct
+import array
+import bisect
 
 import rutil
 import gengraph
+import streamio
 
 
 # Enumerated type for update mode:
 # synchronous:  First compute all next states for all rats, and then move them
 # ratOrder:     For each rat: compute its next state and move it immediately
+# batch:        Repeatedly compute next states for batch of rats, and then move them
+# fast:         Synchronous, but choose moves using alias table built once for each occupied node.
+#               Statistically equivalent to synchronous mode, but NOT identical to reference
+# tuned:        Batch, with batch size chosen by a BatchPolicy.  Matches reference only if sizes match
 class UpdateMode:
-    ratOrder, batch, synchronous = range(3)
+    ratOrder, batch, synchronous, fast, tuned = range(5)
+
+# Policies for choosing batch size in tuned update mode
+# size:N:   Batches of N rats
+# count:N:  N batches per step
+# measured: Time one step with each candidate size, from standard batch size up to all rats,
+#           and use the one with lowest cost per rat.  State is restored after each trial
+class BatchPolicy:
+    (size, count, measured) = range(3)
+    policyNames = ["size", "count", "measured"]
+    policy = measured
+    value = 0
+
+    def __init__(self, policy = measured, value = 0):
+        self.policy = policy
+        self.value = value
+
+    # Parse policy specification.  Returns None if invalid
+    def parse(self, spec):
+        fields = spec.split(':')
+        if fields[0] not in self.policyNames:
+            return None
+        policy = self.policyNames.index(fields[0])
+        if policy == self.measured:
+            return BatchPolicy(policy) if len(fields) == 1 else None
+        try:
+            value = int(fields[1]) if len(fields) == 2 else 0
+        except ValueError:
+            return None
+        return BatchPolicy(policy, value) if value > 0 else None
+
+    def name(self):
+        if self.policy == self.measured:
+            return self.policyNames[self.policy]
+        return "%s:%d" % (self.policyNames[self.policy], self.value)
+
+# Checkpoint file format.  All values little-endian
+# Header: magic, version, N, R, time, update mode, batch size, load factor
+# Followed by R 32-bit node Ids, and then R 32-bit RNG seeds
+checkpointMagic = "GRCK"
+checkpointVersion = 1
+checkpointHeader = "<4sIiiiiid"
 
 
 # Representation of single rat
@@ -80,6 +130,137 @@ class Node:
         self.ratCount -= 1
 
 
+# Read-only view of simulation state, such as node counts or rat positions.
+# Refers to simulator's storage rather than copying it, and so reflects later steps.
+# Use tolist() to get a copy.
+# Optional field extracts value from each element of underlying sequence
+class StateView:
+    seq = []
+    field = None
+
+    def __init__(self, seq, field = None):
+        self.seq = seq
+        self.field = field
+
+    def __len__(self):
+        return len(self.seq)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in xrange(*idx.indices(len(self.seq)))]
+        if self.field is None:
+            return self.seq[idx]
+        return self.field(self.seq[idx])
+
+    def __iter__(self):
+        if self.field is None:
+            return iter(self.seq)
+        return (self.field(x) for x in self.seq)
+
+    def tolist(self):
+        return list(self)
+
+# Detection of equilibrium, based on per-step signature of node counts:
+# l1:        L1 distance between counts of successive steps, divided by twice the number of rats
+#            (fraction of rats that moved, net of rats moving in the opposite direction)
+# occupancy: Fraction of nodes having at least one rat
+# Since rats keep moving, signatures don't settle to zero, but fluctuate around a steady level,
+# possibly oscillating.  Equilibrium holds when the means of the two halves of a window of
+# steps differ by no more than tolerance, relative to the mean over the window.
+# When detected, either stop, or continue, emitting counts only every interval steps
+class EquilibriumMonitor:
+    (l1, occupancy) = range(2)
+    signatureNames = ["l1", "occupancy"]
+    (stop, sparse) = range(2)
+    signature = l1
+    tolerance = 0.01
+    window = 20
+    action = stop
+    interval = 10
+    values = []         # Signatures of most recent steps, up to window
+    previous = None     # Counts of previous step, for L1 distance
+    detectedStep = -1   # Step at which equilibrium detected.  -1 until then
+
+    def __init__(self, signature = l1, tolerance = 0.01, window = 20, action = stop, interval = 10):
+        self.signature = signature
+        self.tolerance = tolerance
+        self.window = max(window, 2)
+        self.action = action
+        self.interval = interval
+        self.values = []
+        self.previous = None
+        self.detectedStep = -1
+
+    # Parse specification SIG[:TOL[:WINDOW[:ACTION]]], where ACTION is stop or sparseK.
+    # Returns None if invalid
+    def parse(self, spec):
+        fields = spec.split(':')
+        if fields[0] not in self.signatureNames or len(fields) > 4:
+            return None
+        monitor = EquilibriumMonitor(self.signatureNames.index(fields[0]))
+        try:
+            if len(fields) > 1:
+                monitor.tolerance = float(fields[1])
+            if len(fields) > 2:
+                monitor.window = max(int(fields[2]), 2)
+            if len(fields) > 3:
+                if fields[3] == "stop":
+                    monitor.action = self.stop
+                elif fields[3].startswith("sparse"):
+                    monitor.action = self.sparse
+                    if fields[3] != "sparse":
+                        monitor.interval = int(fields[3][len("sparse"):])
+                    if monitor.interval < 1:
+                        return None
+                else:
+                    return None
+        except ValueError:
+            return None
+        return monitor
+
+    def name(self):
+        action = "stop" if self.action == self.stop else "sparse%d" % self.interval
+        return "%s:%g:%d:%s" % (self.signatureNames[self.signature], self.tolerance, self.window, action)
+
+    # Signature of counts.  None if not yet defined
+    def signatureValue(self, counts):
+        current = array.array('i', counts)
+        if self.signature == self.occupancy:
+            return float(len(current) - current.count(0)) / len(current) if len(current) > 0 else 0.0
+        previous = self.previous
+        self.previous = current
+        if previous is None:
+            return None
+        total = sum(current)
+        if total == 0:
+            return 0.0
+        return sum([abs(a - b) for (a, b) in zip(current, previous)]) / (2.0 * total)
+
+    # Record counts of step t.  Returns True at the step where equilibrium is first detected
+    def update(self, t, counts):
+        if self.detectedStep >= 0:
+            return False
+        value = self.signatureValue(counts)
+        if value is None:
+            return False
+        self.values.append(value)
+        if len(self.values) > self.window:
+            self.values.pop(0)
+        if len(self.values) < self.window:
+            return False
+        half = self.window / 2
+        first = sum(self.values[:half]) / half
+        second = sum(self.values[-half:]) / half
+        mean = sum(self.values) / self.window
+        if abs(second - first) > self.tolerance * mean:
+            return False
+        self.detectedStep = t
+        return True
+
+# Batch size of batch update mode: max(sqrt(R), 0.02 * R)
+def standardBatchSize(rcount):
+    return max(int(math.sqrt(rcount)), int(0.02 * rcount))
+
 # Overall simulation.  This one only operates in "drive" or "benchmark" mode
 class Simulator:
     nodes = []
@@ -87,14 +268,24 @@ class Simulator:
     time = 0          # Number of steps simulated
     loadFactor = 0.0  # Ratio of rats to nodes
     batchSize = 0
+    batchPolicy = None  # How batch size is chosen in tuned mode
+    tunedBatchSize = 0  # Batch size of tuned mode.  0 until chosen
+    updateMode = UpdateMode.synchronous  # Most recently used update mode
+    outFile = None    # Destination of driver output
+    statsOnly = False # Generate per-step statistics rather than full driver output
+    outputBuffers = 0 # When > 0, format and write output on separate thread, using this many frame buffers
+    frameWriter = None
+    profiler = None   # Optional instrument.Profiler recording time spent in each phase
+    monitor = None    # Optional EquilibriumMonitor
 
-    def __init__(self, graph):
+    def __init__(self, graph, outFile = None):
         self.nodes = [Node(id) for id in xrange(graph.nodeCount)]
         for (hidx,tidx) in graph.edgeList():
             head = self.nodes[hidx]
             tail = self.nodes[tidx]
             head.addNeighbor(tail)
         self.time = 0
+        self.outFile = sys.stdout if outFile is None else outFile
 
     # Check whether string is a comment
     def isComment(self, s):
@@ -121,8 +312,8 @@ class Simulator:
                 continue
             if first:
                 ncount, rcount = map(int, line.split())
-                if ncount != len(self.nodes):
-                    self.errorMsg("Mismatch.  Graph has %d nodes.  Rat file has %d nodes.  No rats addded." % (len(self.nodes), ncount))
+                if ncount != self.nodeCount():
+                    self.errorMsg("Mismatch.  Graph has %d nodes.  Rat file has %d nodes.  No rats addded." % (self.nodeCount(), ncount))
                     return
                 first = False
             else:
@@ -131,8 +322,8 @@ class Simulator:
         f.close()
         self.restart(ratPositions, seed)
         sys.stderr.write("Loaded %d rats\n" % rcount)
-        self.loadFactor = float(rcount) / len(self.nodes)
-        self.batchSize = max(int(math.sqrt(rcount)), int(0.02 * rcount))
+        self.loadFactor = float(rcount) / self.nodeCount()
+        self.batchSize = standardBatchSize(rcount)
         return True
 
     # Restart simulation.  Use rat position array read from file
@@ -153,6 +344,21 @@ class Simulator:
     def ratCount(self):
         return len(self.rats)
 
+    def nodeCount(self):
+        return len(self.nodes)
+
+    # Return list with node Id of each rat
+    def ratPositions(self):
+        return [r.node.id for r in self.rats]
+
+    # Return list with RNG seed of each rat
+    def ratSeeds(self):
+        return [r.rng.seed for r in self.rats]
+
+    def setRatSeeds(self, seeds):
+        for (r, seed) in zip(self.rats, seeds):
+            r.rng.seed = seed
+
     def finish(self):
         self.driveDone()
 
@@ -167,32 +373,179 @@ class Simulator:
                 self.errorMsg("Couldn't open file '%s'" % fname)
                 self.finish()
                 return False
-        f.write("%d %d\n" % (len(self.nodes), self.ratCount()))
-        for r in self.rats:
-            f.write("%d\n" % r.position.id)
+        f.write("%d %d\n" % (self.nodeCount(), self.ratCount()))
+        for nid in self.ratPositions():
+            f.write("%d\n" % nid)
+        if fname != "":
+            f.close()
+        return True
+
+    # Convert array to/from little-endian byte order used in checkpoint files
+    def swapBytes(self, a):
+        if sys.byteorder != "little":
+            a.byteswap()
+        return a
+
+    # Batch size recorded in checkpoint is that of update mode
+    def checkpointBatchSize(self):
+        if self.updateMode == UpdateMode.tuned:
+            return self.tunedBatchSize
+        return self.batchSize
+
+    # Write complete simulation state to binary checkpoint file
+    def storeCheckpoint(self, fname):
+        try:
+            f = open(fname, "wb")
+        except Exception as e:
+            self.errorMsg("Couldn't open checkpoint file '%s': %s" % (fname, e))
+            return False
+        f.write(struct.pack(checkpointHeader, checkpointMagic, checkpointVersion,
+                            self.nodeCount(), self.ratCount(), self.time,
+                            self.updateMode, self.checkpointBatchSize(), self.loadFactor))
+        positions = self.swapBytes(array.array('i', self.ratPositions()))
+        seeds = self.swapBytes(array.array('I', self.ratSeeds()))
+        f.write(positions.tostring())
+        f.write(seeds.tostring())
         f.close()
         return True
 
+    # Restore simulation state from checkpoint file.
+    # Continuing simulation gives same results as if never interrupted
+    def loadCheckpoint(self, fname):
+        try:
+            f = open(fname, "rb")
+        except Exception as e:
+            self.errorMsg("Couldn't open checkpoint file '%s': %s" % (fname, e))
+            return False
+        try:
+            hsize = struct.calcsize(checkpointHeader)
+            (magic, version, ncount, rcount, time, update, bsize, load) = struct.unpack(checkpointHeader, f.read(hsize))
+            if magic != checkpointMagic or version != checkpointVersion:
+                self.errorMsg("File '%s' is not a version %d checkpoint file" % (fname, checkpointVersion))
+                return False
+            if ncount != self.nodeCount():
+                self.errorMsg("Mismatch.  Graph has %d nodes.  Checkpoint file has %d nodes." % (self.nodeCount(), ncount))
+                return False
+            positions = array.array('i')
+            positions.fromstring(f.read(4 * rcount))
+            seeds = array.array('I')
+            seeds.fromstring(f.read(4 * rcount))
+        except Exception as e:
+            self.errorMsg("Invalid checkpoint file '%s': %s" % (fname, e))
+            return False
+        finally:
+            f.close()
+        self.restart(self.swapBytes(positions).tolist())
+        if self.ratCount() != rcount:
+            return False
+        self.setRatSeeds(self.swapBytes(seeds).tolist())
+        self.time = time
+        self.updateMode = update
+        # Keep batch size of tuned run, so that resumed run matches uninterrupted one
+        if update == UpdateMode.tuned:
+            self.batchSize = standardBatchSize(rcount)
+            self.tunedBatchSize = bsize
+            self.batchPolicy = BatchPolicy(BatchPolicy.size, bsize)
+        else:
+            self.batchSize = bsize
+        self.loadFactor = load
+        sys.stderr.write("Restored %d rats at time %d\n" % (rcount, time))
+        return True
+
     # Return list with count of rats for each node
     def populationList(self):
         return [nd.ratCount for nd in self.nodes]
 
+    # Views of current state without copying
+    def countView(self):
+        return StateView(self.nodes, lambda nd: nd.ratCount)
+
+    def positionView(self):
+        return StateView(self.rats, lambda r: r.node.id)
+
     # Generate output suitable for reading into another copy of program running in driven or benchmark mode
     # First line is header "STEP" as identifier
     # Second line of form "N R", where N is number of nodes, and R is number of rats
     # Each successive line then lists the number of rats at each node
     # Terminate with line "END"
-    def driveOut(self, f = sys.stdout, display = True):
-        f.write("STEP %d %d\n" % (len(self.nodes), self.ratCount()))
+    def driveOut(self, f = None, display = True):
+        if f is None and self.frameWriter is not None:
+            buf = None
+            if display:
+                buf = self.frameWriter.acquire()
+                buf[:] = self.populationList()
+            self.frameWriter.putFrame(self.nodeCount(), self.ratCount(), buf)
+            return
+        if f is None:
+            f = self.outFile
+        # Form frame as single string, so that it can be handed to writer in one piece
+        lines = ["STEP %d %d\n" % (self.nodeCount(), self.ratCount())]
         if display:
-            for nd in self.nodes:
-                f.write("%d\n" % nd.ratCount)
-        f.write("END\n")
+            lines += self.countLines()
+        lines.append("END\n")
+        f.write("".join(lines))
                 
+    # Lines of driver output giving count of each node
+    def countLines(self):
+        return ["%d\n" % c for c in self.populationList()]
+
+    # Destination for text output.  Goes through frame writer when pipelining, to keep output in order
+    def sink(self):
+        return self.outFile if self.frameWriter is None else self.frameWriter
+
+    # Number of nodes having each rat count
+    def countHistogram(self):
+        hist = {}
+        for c in self.populationList():
+            hist[c] = hist.get(c, 0) + 1
+        return hist
+
+    # Compute summary statistics of current state in single pass over node counts:
+    # (maximum count, number of occupied nodes, variance of count/loadFactor, entropy in bits)
+    # Since mean of count/loadFactor is 1, variance is mean of (count/loadFactor)^2 - 1
+    # Entropy is of distribution of rats over nodes
+    def stepStats(self):
+        hist = self.countHistogram()
+        ncount = self.nodeCount()
+        rcount = self.ratCount()
+        if rcount == 0:
+            return (0, 0, 0.0, 0.0)
+        maxCount = max(hist.keys())
+        occupied = ncount - hist.get(0, 0)
+        sumSquares = 0.0
+        sumLogs = 0.0
+        # Sum in order of count, so that result doesn't depend on how histogram was built
+        for (c, n) in sorted(hist.items()):
+            if c > 0:
+                sumSquares += n * c * c
+                sumLogs += n * c * math.log(c, 2)
+        variance = sumSquares / (ncount * self.loadFactor * self.loadFactor) - 1.0
+        entropy = math.log(rcount, 2) - sumLogs / rcount
+        return (maxCount, occupied, variance, entropy)
+
+    # Generate output of statistics, one line per step
+    def statsHeader(self, f = None):
+        if f is None:
+            f = self.sink()
+        f.write("# STATS %d %d: step max-count occupied-nodes load-variance entropy\n" % (self.nodeCount(), self.ratCount()))
+
+    # Record batch size of tuned mode, so that run can be reproduced with policy size:N
+    def batchHeader(self, f = None):
+        if f is None:
+            f = self.sink()
+        f.write("# BATCH %d %s\n" % (self.tunedBatchSize, self.policy().name()))
+
+    def statsOut(self, f = None):
+        if f is None:
+            f = self.sink()
+        f.write("%d %d %d %.6f %.6f\n" % ((self.time,) + self.stepStats()))
+
     # Final line of driver output, to indicate simulation has completed
     # It's a good idea to put this at the end of any output to signal the visualizer
     # that the program is terminating
-    def driveDone(self, f = sys.stdout):
+    def driveDone(self, f = None):
+        if f is None:
+            f = self.sink()
         f.write("DONE\n")
 
     # Should print any information messages on stderr, since stdout is being piped into another program
@@ -201,34 +554,507 @@ class Simulator:
             text += '\n'
         sys.stderr.write(text)
 
-    # Basic simulation step
-    def simulate(self, stepCount = 1, update = UpdateMode.synchronous, displayInterval = 1):
-        # Determine batch size
-        bsize = len(self.rats)
+    # Number of rats to process between updates for given update mode
+    def updateBatchSize(self, update):
         if update == UpdateMode.batch:
-            bsize = self.batchSize
+            return self.batchSize
+        elif update == UpdateMode.tuned:
+            if self.tunedBatchSize == 0:
+                self.tunedBatchSize = self.chooseBatchSize()
+                sys.stderr.write("Batch size %d (policy %s)\n" % (self.tunedBatchSize, self.policy().name()))
+            return self.tunedBatchSize
         elif update == UpdateMode.ratOrder:
-            bsize = 1
-        display = True
-        # Emit initial state
-        self.driveOut(display = display)
+            return 1
+        return self.ratCount()
+
+    def policy(self):
+        return self.batchPolicy if self.batchPolicy is not None else BatchPolicy()
+
+    # Batch size for tuned mode.  Starts from standard batch size
+    def chooseBatchSize(self):
+        policy = self.policy()
+        nrats = max(self.ratCount(), 1)
+        if policy.policy == BatchPolicy.size:
+            return min(policy.value, nrats)
+        elif policy.policy == BatchPolicy.count:
+            return (nrats + policy.value - 1) / policy.value
+        candidates = []
+        bsize = max(self.batchSize, 1)
+        while bsize < nrats:
+            candidates.append(bsize)
+            bsize *= 2
+        candidates.append(nrats)
+        # Trial steps use and then restore current state
+        positions = self.ratPositions()
+        seeds = self.ratSeeds()
+        savedTime = self.time
+        savedProfiler = self.profiler
+        savedMode = self.updateMode
+        self.profiler = None
+        self.updateMode = UpdateMode.batch
+        best = None
+        for bsize in candidates:
+            tstart = time.time()
+            self.runStep(bsize)
+            cost = time.time() - tstart
+            if best is None or cost < best[0]:
+                best = (cost, bsize)
+            self.restart(positions)
+            self.setRatSeeds(seeds)
+        self.time = savedTime
+        self.profiler = savedProfiler
+        self.updateMode = savedMode
+        return best[1]
+
+    # Move every rat once, processing batches of bsize rats
+    def runStep(self, bsize):
+        if self.updateMode == UpdateMode.fast:
+            self.runStepFast()
+            return
+        if self.profiler is not None:
+            self.runStepProfiled(bsize)
+            return
+        ridx = 0
+        while ridx < len(self.rats):
+            bcount = min(bsize, len(self.rats) - ridx)
+            for i in xrange(bcount):
+                r = self.rats[i+ridx]
+                r.next(loadFactor = self.loadFactor)
+            for i in xrange(bcount):
+                r = self.rats[i+ridx]
+                r.move()
+            ridx += bcount
+
+    # Same as runStep, but record time spent computing and moving
+    def runStepProfiled(self, bsize):
+        prof = self.profiler
+        ridx = 0
+        while ridx < len(self.rats):
+            bcount = min(bsize, len(self.rats) - ridx)
+            weights = 0
+            prof.begin("compute")
+            for i in xrange(bcount):
+                r = self.rats[i+ridx]
+                weights += len(r.node.region)
+                r.next(loadFactor = self.loadFactor)
+            prof.end()
+            prof.count(weights, bcount)
+            prof.begin("move")
+            for i in xrange(bcount):
+                r = self.rats[i+ridx]
+                r.move()
+            prof.end()
+            ridx += bcount
+
+    # Move every rat once in fast mode.
+    # Build alias table for each occupied node from counts at start of step,
+    # so that each move takes constant time, regardless of node degree
+    def runStepFast(self):
+        prof = self.profiler
+        if prof is not None:
+            prof.begin("compute")
+        tables = {}
+        weights = 0
+        for r in self.rats:
+            nd = r.node
+            table = tables.get(nd.id)
+            if table is None:
+                table = rutil.AliasTable([rutil.mweight(float(n.ratCount)/self.loadFactor) for n in nd.region])
+                tables[nd.id] = table
+                weights += len(nd.region)
+            r.newNode = nd.region[table.sample(r.rng)]
+        if prof is not None:
+            prof.end()
+            prof.count(weights, len(tables))
+            prof.begin("move")
+        for r in self.rats:
+            r.move()
+        if prof is not None:
+            prof.end()
+
+    # Generate driver output, recording time when profiling
+    def output(self, display = True):
+        if self.profiler is not None:
+            self.profiler.begin("output")
+        if self.statsOnly:
+            self.statsOut()
+        else:
+            self.driveOut(display = display)
+        if self.profiler is not None:
+            self.profiler.end()
+
+    # Feed counts of current step to equilibrium monitor.
+    # Returns True at the step where equilibrium is first detected
+    def checkEquilibrium(self, counts):
+        if self.monitor is None or not self.monitor.update(self.time, counts):
+            return False
+        sys.stderr.write("Equilibrium detected at step %d (%s)\n" % (self.time, self.monitor.name()))
+        return True
+
+    # Run simulation for stepCount steps, generating (time, view) for the initial state,
+    # and then for every step where time is a multiple of interval, as well as the final step.
+    # View is of node counts, or of rat positions when positions is True.
+    # Views refer to simulator state, and so are only valid until the next step.
+    # Steps are computed as the generator is consumed
+    def steps(self, stepCount = 1, update = UpdateMode.synchronous, interval = 1, positions = False):
+        self.updateMode = update
+        bsize = self.updateBatchSize(update)
+        view = self.positionView() if positions else self.countView()
+        if self.profiler is not None:
+            self.profiler.startStep(self.time)
+        yield (self.time, view)
         for step in xrange(stepCount):
-            ridx = 0
-            while ridx < len(self.rats):
-                bcount = min(bsize, len(self.rats) - ridx)
-                for i in xrange(bcount):
-                    r = self.rats[i+ridx]
-                    r.next(loadFactor = self.loadFactor)
-                for i in xrange(bcount):
-                    r = self.rats[i+ridx]
-                    r.move()
-                ridx += bcount
+            if self.profiler is not None:
+                self.profiler.startStep(self.time + 1)
+            self.runStep(bsize)
             self.time += 1
-            # Emit new state
-            display = step == stepCount-1 or ((step+1) % displayInterval) == 0
-            self.driveOut(display = display)
-        self.driveDone()
-                
-                
-                
-                
+            # Base interval on time, so that resumed runs match uninterrupted ones
+            if step == stepCount-1 or (self.time % interval) == 0:
+                yield (self.time, view)
+
+    # Basic simulation step
+    def simulate(self, stepCount = 1, update = UpdateMode.synchronous, displayInterval = 1):
+        if self.outputBuffers > 0:
+            self.frameWriter = streamio.FrameWriter(self.outFile, self.outputBuffers)
+        startTime = self.time
+        endTime = self.time + stepCount
+        # Close frame writer even if step or output fails, so that queued frames get written
+        # and writer thread is joined
+        try:
+            if self.statsOnly:
+                self.statsHeader()
+            if update == UpdateMode.tuned:
+                self.updateBatchSize(update)
+                self.batchHeader()
+            # Driver output has frame for every step, but only includes counts every displayInterval steps
+            for (t, counts) in self.steps(stepCount, update):
+                found = self.checkEquilibrium(counts)
+                if found and self.monitor.action == EquilibriumMonitor.stop:
+                    endTime = t
+                elif found:
+                    displayInterval = self.monitor.interval
+                display = t in [startTime, endTime] or (t % displayInterval) == 0
+                self.output(display = display)
+                if found:
+                    self.sink().write("# EQUILIBRIUM %d %s\n" % (t, self.monitor.name()))
+                if t == endTime:
+                    break
+            self.driveDone()
+        finally:
+            if self.frameWriter is not None:
+                fw = self.frameWriter
+                self.frameWriter = None
+                fw.close()
+
+
+# Compact representation of simulation state, requiring neither NumPy nor per-rat objects.
+# State is held in arrays: node Id and RNG seed of each rat, and rat count of each node.
+# Regions are stored in a single flat array, with regionStart giving the offset of each one.
+# Moves are computed with the same arithmetic, in the same order, as Rat.next,
+# and so results are identical to those of the object model.
+# Mix in ahead of Simulator, or of one of its subclasses
+#
+# When rats start concentrated on few nodes, most nodes are empty for many steps.
+# While the fraction of occupied nodes is below sparseThreshold, the set of occupied
+# nodes is maintained, so that the weight table, statistics, and driver output
+# cost time proportional to the number of occupied nodes and their neighbors,
+# rather than to the number of nodes.  Once occupancy exceeds the threshold,
+# tracking stops and the dense path is used for the rest of the run
+class CompactState:
+    positions = None    # Node Id of each rat
+    seeds = None        # RNG seed of each rat
+    counts = None       # Rat count of each node
+    regionStart = None  # Offset of each node's region.  Extra entry at end
+    regionNodes = None  # Regions (own node + adjacency list) of all nodes, concatenated
+    weights = None      # Table of mweight(c/loadFactor), indexed by count c
+    sparseThreshold = 0.25  # Track occupied nodes while occupied fraction is below this.  0 disables
+    active = None       # Set of occupied nodes.  None when using dense path
+    changed = None      # Nodes whose counts may have changed since count lines last generated
+    lines = None        # Count lines of most recent driver output, when tracking
+    nodeIds = None      # Node Id stored in each slot, when laid out in non-natural order.  None otherwise
+    slots = None        # Slot of each node Id, when laid out in non-natural order.  None otherwise
+
+    # Optional order gives sequence of node Ids in which to lay out node storage.
+    # Arrays are indexed by slot, and regions hold slots, in the original neighbor order.
+    # Ids are mapped at input and output, so that rat files, outputs, and random choices are unaffected
+    def __init__(self, graph, outFile = None, order = None):
+        n = graph.nodeCount
+        elist = graph.edgeList()
+        if order is not None:
+            if sorted(order) != range(n):
+                raise ValueError("Node order is not a permutation of %d nodes" % n)
+            self.nodeIds = array.array('i', order)
+            self.slots = array.array('i', [0] * n)
+            for pos in xrange(n):
+                self.slots[order[pos]] = pos
+            slots = self.slots
+            elist = [(slots[hidx], slots[tidx]) for (hidx, tidx) in elist]
+        sizes = [1] * n
+        for (hidx, tidx) in elist:
+            sizes[hidx] += 1
+        self.regionStart = array.array('i', [0] * (n+1))
+        for nid in xrange(n):
+            self.regionStart[nid+1] = self.regionStart[nid] + sizes[nid]
+        self.regionNodes = array.array('i', [0] * self.regionStart[n])
+        fill = array.array('i', self.regionStart)
+        for nid in xrange(n):
+            self.regionNodes[fill[nid]] = nid
+            fill[nid] += 1
+        for (hidx, tidx) in elist:
+            self.regionNodes[fill[hidx]] = tidx
+            fill[hidx] += 1
+        self.counts = array.array('i', [0] * n)
+        self.positions = array.array('i')
+        self.seeds = array.array('i')
+        self.weights = array.array('d')
+        self.time = 0
+        self.outFile = sys.stdout if outFile is None else outFile
+
+    def restart(self, ratPositions = [], seed = rutil.DEFAULTSEED):
+        n = len(self.counts)
+        for nid in xrange(n):
+            self.counts[nid] = 0
+        self.time = 0
+        self.weights = array.array('d')
+        valid = ratPositions
+        for rid in xrange(len(ratPositions)):
+            nid = ratPositions[rid]
+            if nid < 0 or nid >= n:
+                self.errorMsg("Invalid rat position: %d.  Ignoring" % nid)
+                valid = ratPositions[:rid]
+                break
+        if self.slots is not None:
+            slots = self.slots
+            valid = [slots[nid] for nid in valid]
+        self.positions = array.array('i', valid)
+        counts = self.counts
+        for nid in self.positions:
+            counts[nid] += 1
+        # Same as RNG.reseed([seed, rid])
+        G, M, V = rutil.GROUPSIZE, rutil.MVAL, rutil.VVAL
+        s0 = ((seed+1) * V + rutil.INITSEED * M) % G
+        self.seeds = array.array('i', [((rid+1) * V + s0 * M) % G for rid in xrange(len(valid))])
+        self.active = set(self.positions)
+        self.changed = set()
+        self.lines = None
+        self.checkDensity()
+
+    # Switch to dense path once occupancy exceeds threshold
+    def checkDensity(self):
+        if self.active is not None and len(self.active) > self.sparseThreshold * len(self.counts):
+            self.active = None
+            self.changed = None
+            self.lines = None
+
+    # Update set of occupied nodes after rats moved from nodes in old to nodes in new
+    def trackMoves(self, old, new):
+        touched = set(old)
+        touched.update(new)
+        self.changed.update(touched)
+        active = self.active
+        counts = self.counts
+        for nid in touched:
+            if counts[nid] > 0:
+                active.add(nid)
+            else:
+                active.discard(nid)
+
+    def countHistogram(self):
+        if self.active is None:
+            return Simulator.countHistogram(self)
+        counts = self.counts
+        hist = {0 : len(counts) - len(self.active)}
+        for nid in self.active:
+            c = counts[nid]
+            hist[c] = hist.get(c, 0) + 1
+        return hist
+
+    # Reformat only lines of nodes whose counts changed
+    def countLines(self):
+        if self.active is None:
+            return Simulator.countLines(self)
+        counts = self.counts
+        ids = self.nodeIds
+        if self.lines is None:
+            self.lines = ["%d\n" % c for c in self.countView()]
+        else:
+            lines = self.lines
+            for nid in self.changed:
+                lines[nid if ids is None else ids[nid]] = "%d\n" % counts[nid]
+        self.changed = set()
+        return self.lines
+
+    def ratCount(self):
+        return len(self.positions)
+
+    def nodeCount(self):
+        return len(self.counts)
+
+    def ratPositions(self):
+        if self.nodeIds is not None:
+            ids = self.nodeIds
+            return [ids[nid] for nid in self.positions]
+        return self.positions.tolist()
+
+    def ratSeeds(self):
+        return self.seeds.tolist()
+
+    def setRatSeeds(self, seeds):
+        self.seeds = array.array('i', seeds)
+
+    def populationList(self):
+        if self.slots is not None:
+            counts = self.counts
+            return [counts[slot] for slot in self.slots]
+        return self.counts.tolist()
+
+    def countView(self):
+        if self.slots is not None:
+            return StateView(self.slots, self.counts.__getitem__)
+        return StateView(self.counts)
+
+    def positionView(self):
+        if self.nodeIds is not None:
+            return StateView(self.positions, self.nodeIds.__getitem__)
+        return StateView(self.positions)
+
+    # Build weight table covering all current counts, after restart.
+    # Moves then extend table as counts grow, one entry at a time
+    def extendWeights(self):
+        if len(self.weights) > 0:
+            return
+        if self.active is not None:
+            counts = self.counts
+            maxCount = max([counts[nid] for nid in self.active]) if len(self.active) > 0 else 0
+        else:
+            maxCount = max(self.counts) if len(self.counts) > 0 else 0
+        wt = self.weights
+        for c in xrange(len(wt), maxCount + 1):
+            wt.append(rutil.mweight(float(c)/self.loadFactor))
+
+    def runStep(self, bsize):
+        if self.updateMode == UpdateMode.fast:
+            self.runStepFast()
+            return
+        prof = self.profiler
+        positions = self.positions
+        seeds = self.seeds
+        counts = self.counts
+        rstart = self.regionStart
+        rnodes = self.regionNodes
+        G, M, V = rutil.GROUPSIZE, rutil.MVAL, rutil.VVAL
+        bisectRight = bisect.bisect_right
+        nrats = len(positions)
+        targets = array.array('i', [0] * min(bsize, nrats))
+        self.extendWeights()
+        wt = self.weights
+        ridx = 0
+        while ridx < nrats:
+            bcount = min(bsize, nrats - ridx)
+            if prof is not None:
+                prof.begin("compute")
+            # Counts don't change while computing moves for batch,
+            # and so cumulative weights can be shared by all rats at node
+            cumulative = {}
+            weightCount = 0
+            for i in xrange(ridx, ridx + bcount):
+                nid = positions[i]
+                entry = cumulative.get(nid)
+                if entry is None:
+                    start = rstart[nid]
+                    cum = []
+                    psum = 0.0
+                    for j in xrange(start, rstart[nid+1]):
+                        psum += wt[counts[rnodes[j]]]
+                        cum.append(psum)
+                    entry = (start, cum)
+                    cumulative[nid] = entry
+                    weightCount += len(cum)
+                start, cum = entry
+                # Same as RNG.randFloat followed by linear search in RNG.weightedIndex
+                seed = (V + seeds[i] * M) % G
+                seeds[i] = seed
+                idx = bisectRight(cum, (float(seed)/G) * cum[-1])
+                if idx == len(cum):
+                    idx -= 1
+                targets[i - ridx] = rnodes[start + idx]
+            if prof is not None:
+                prof.end()
+                prof.count(weightCount, len(cumulative))
+                prof.begin("move")
+            if self.active is not None:
+                old = positions[ridx:ridx + bcount]
+            for i in xrange(ridx, ridx + bcount):
+                nid = targets[i - ridx]
+                counts[positions[i]] -= 1
+                c = counts[nid] + 1
+                counts[nid] = c
+                if c == len(wt):
+                    wt.append(rutil.mweight(float(c)/self.loadFactor))
+                positions[i] = nid
+            if self.active is not None:
+                self.trackMoves(old, targets[:bcount])
+            if prof is not None:
+                prof.end()
+            ridx += bcount
+        self.checkDensity()
+
+    # Fast mode, with same alias tables and choices as Simulator.runStepFast
+    def runStepFast(self):
+        prof = self.profiler
+        if prof is not None:
+            prof.begin("compute")
+        positions = self.positions
+        seeds = self.seeds
+        counts = self.counts
+        rstart = self.regionStart
+        rnodes = self.regionNodes
+        G, M, V = rutil.GROUPSIZE, rutil.MVAL, rutil.VVAL
+        self.extendWeights()
+        wt = self.weights
+        nrats = len(positions)
+        targets = array.array('i', [0] * nrats)
+        tables = {}
+        weightCount = 0
+        for i in xrange(nrats):
+            nid = positions[i]
+            entry = tables.get(nid)
+            if entry is None:
+                start = rstart[nid]
+                region = rnodes[start:rstart[nid+1]]
+                table = rutil.AliasTable([wt[counts[r]] for r in region])
+                entry = (region, len(region), table.prob, table.alias)
+                tables[nid] = entry
+                weightCount += len(region)
+            region, n, prob, alias = entry
+            # Same as AliasTable.sample
+            seed = (V + seeds[i] * M) % G
+            seeds[i] = seed
+            val = (float(seed)/G) * n
+            idx = min(int(val), n-1)
+            if val - idx >= prob[idx]:
+                idx = alias[idx]
+            targets[i] = region[idx]
+        if prof is not None:
+            prof.end()
+            prof.count(weightCount, len(tables))
+            prof.begin("move")
+        for i in xrange(nrats):
+            nid = targets[i]
+            counts[positions[i]] -= 1
+            c = counts[nid] + 1
+            counts[nid] = c
+            if c == len(wt):
+                wt.append(rutil.mweight(float(c)/self.loadFactor))
+        if self.active is not None:
+            self.trackMoves(positions, targets)
+        # Update in place, so that views of positions remain valid
+        positions[:] = targets
+        if self.active is not None:
+            self.checkDensity()
+        if prof is not None:
+            prof.end()
+
+# Simulator using compact state
+class CompactSimulator(CompactState, Simulator):
+    pass
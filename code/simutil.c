@@ -67,6 +67,15 @@ static state_t *new_rats(graph_t *g, int nrat, random_t global_seed) {
     return s;
 }
 
+/* Free simulation state.  Doesn't free graph */
+void free_rats(state_t *s) {
+    free(s->rat_position);
+    free(s->next_rat_position);
+    free(s->rat_seed);
+    free(s->rat_count);
+    free(s);
+}
+
 /* Set seed values for the rats.  Maybe you could use multiple threads ... */
 static void seed_rats(state_t *s) {
     random_t global_seed = s->global_seed;
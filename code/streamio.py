@@ -0,0 +1,381 @@
+# Support for reading and writing simulator output streams
+# Output can be compressed according to file extension, and written by background thread
+# Input is decompressed on the fly, based on the leading bytes of the stream
+
+import sys
+import os
+import threading
+import Queue
+import zlib
+import bz2
+
+# Some installations don't support lzma library.
+# Import it only if needed
+
+lzmaImported = False
+lzma = None
+
+def importLzma():
+    global lzmaImported, lzma
+    if not lzmaImported:
+        try:
+            import lzma
+        except ImportError:
+            try:
+                from backports import lzma
+            except ImportError:
+                lzma = None
+    lzmaImported = True
+    if lzma is None:
+        raise IOError("lzma compression requires lzma module (Python 2: backports.lzma)")
+    return lzma
+
+# Number of bytes to read from input at once
+chunkSize = 1 << 16
+
+# Default number of pending writes allowed before writer blocks
+defaultDepth = 16
+
+# Enumerated type for compression formats
+class Compression:
+    none, gzip, bz2, lzma = range(4)
+    extensions = {".gz" : gzip, ".bz2" : bz2, ".xz" : lzma, ".lzma" : lzma}
+    magics = [("\x1f\x8b", gzip), ("BZh", bz2), ("\xfd7zXZ\x00", lzma)]
+    magicLength = 6
+
+    # Determine compression from file name
+    def fromName(self, fname):
+        for ext in self.extensions:
+            if fname.endswith(ext):
+                return self.extensions[ext]
+        return self.none
+
+    # Determine compression from leading bytes of stream
+    def fromMagic(self, data):
+        for (magic, ctype) in self.magics:
+            if data.startswith(magic):
+                return ctype
+        return self.none
+
+# Object that compresses successive strings.  Supports compress and flush
+class NullCompressor:
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return ""
+
+def newCompressor(ctype):
+    if ctype == Compression.gzip:
+        # Window bits offset of 16 selects gzip format
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif ctype == Compression.bz2:
+        return bz2.BZ2Compressor()
+    elif ctype == Compression.lzma:
+        return importLzma().LZMACompressor()
+    return NullCompressor()
+
+# Object that decompresses successive strings.  Supports decompress, and unused_data for multi-member streams
+class NullDecompressor:
+    unused_data = ""
+
+    def decompress(self, data):
+        return data
+
+def newDecompressor(ctype):
+    if ctype == Compression.gzip:
+        # Window bits offset of 32 accepts either zlib or gzip header
+        return zlib.decompressobj(32 + zlib.MAX_WBITS)
+    elif ctype == Compression.bz2:
+        return bz2.BZ2Decompressor()
+    elif ctype == Compression.lzma:
+        return importLzma().LZMADecompressor()
+    return NullDecompressor()
+
+# File-like object that compresses and writes data on a background thread.
+# Writes are queued, with at most depth pending, so that memory stays bounded
+# and the writing thread blocks when output can't keep up
+class AsyncWriter:
+    file = None
+    compressor = None
+    queue = None
+    thread = None
+    error = None
+    closeFile = True
+
+    def __init__(self, f, ctype = Compression.none, depth = defaultDepth, closeFile = True):
+        self.file = f
+        self.compressor = newCompressor(ctype)
+        self.queue = Queue.Queue(max(depth, 1))
+        self.error = None
+        self.closeFile = closeFile
+        self.thread = threading.Thread(target = self.run, name = "AsyncWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Body of writer thread.  None on queue signals end of stream
+    def run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self.file.write(self.compressor.compress(data))
+            except Exception as e:
+                self.error = e
+        try:
+            self.file.write(self.compressor.flush())
+            self.file.flush()
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+
+    def checkError(self):
+        if self.error is not None:
+            e = self.error
+            self.error = None
+            raise IOError("Output failed: %s" % e)
+
+    def write(self, data):
+        self.checkError()
+        self.queue.put(data)
+
+    # Data written before flush is handed to writer thread, but may not yet be written
+    def flush(self):
+        self.checkError()
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.closeFile:
+            self.file.close()
+        self.checkError()
+
+# Open output file for simulator output.
+# Compression determined by file extension.  Empty name or "-" indicates stdout
+def openOutput(fname = "", depth = defaultDepth):
+    if fname in ["", "-"]:
+        return AsyncWriter(sys.stdout, depth = depth, closeFile = False)
+    ctype = Compression().fromName(fname)
+    if ctype == Compression.lzma:
+        importLzma()
+    f = open(fname, "wb")
+    return AsyncWriter(f, ctype, depth)
+
+# Iterator over lines of possibly compressed input.
+# Decompression is streamed, so that only chunkSize bytes of input are held at once
+class LineReader:
+    file = None
+    fd = None            # When set, read with os.read, so that data is returned as soon as it's available
+    ctype = Compression.none
+    decompressor = None
+    lines = []           # Complete lines not yet returned
+    pos = 0              # Position of next line in lines
+    partial = ""         # Incomplete final line
+    eof = False
+
+    def __init__(self, f, fd = None):
+        self.file = f
+        self.fd = fd
+        self.ctype = None
+        self.decompressor = None
+        self.lines = []
+        self.pos = 0
+        self.partial = ""
+        self.eof = False
+
+    def readChunk(self):
+        if self.fd is not None:
+            return os.read(self.fd, chunkSize)
+        return self.file.read(chunkSize)
+
+    # Decompress data.  Handle streams formed by concatenating compressed members
+    def decompress(self, data):
+        result = []
+        while len(data) > 0:
+            result.append(self.decompressor.decompress(data))
+            data = self.decompressor.unused_data
+            if len(data) > 0:
+                self.decompressor = newDecompressor(self.ctype)
+        return "".join(result)
+
+    # Read more input.  Return False when input exhausted
+    def fill(self):
+        if self.eof:
+            return False
+        data = self.readChunk()
+        if self.ctype is None:
+            # Gather enough bytes to identify compression format
+            while len(data) < Compression.magicLength:
+                more = self.readChunk()
+                if more == "":
+                    break
+                data += more
+            self.ctype = Compression().fromMagic(data)
+            self.decompressor = newDecompressor(self.ctype)
+        if data == "":
+            self.eof = True
+            text = self.partial
+            if self.decompressor is not None and hasattr(self.decompressor, "flush"):
+                text += self.decompressor.flush()
+            self.partial = ""
+            # Final line may lack terminator
+            self.lines = [line + "\n" for line in text.split("\n")]
+            self.lines[-1] = self.lines[-1][:-1]
+            if self.lines[-1] == "":
+                self.lines.pop()
+        else:
+            self.lines = (self.partial + self.decompress(data)).split("\n")
+            self.partial = self.lines.pop()
+            self.lines = [line + "\n" for line in self.lines]
+        self.pos = 0
+        return True
+
+    def readline(self):
+        while self.pos >= len(self.lines):
+            if not self.fill():
+                return ""
+        line = self.lines[self.pos]
+        self.pos += 1
+        return line
+
+    # Read lines up to and including the next one equal to terminator, e.g., "END\n".
+    # A terminator ending in newline also matches with CRLF line ending.
+    # Returns list of lines, which lacks terminator if input ended first.
+    # Searches for terminator in buffered lines, rather than examining each line
+    def readUntil(self, terminator):
+        terminators = [terminator]
+        if terminator.endswith("\n"):
+            terminators.append(terminator[:-1] + "\r\n")
+        result = []
+        while True:
+            if self.pos >= len(self.lines):
+                if not self.fill():
+                    return result
+                continue
+            idx = -1
+            for t in terminators:
+                try:
+                    tidx = self.lines.index(t, self.pos)
+                except ValueError:
+                    continue
+                if idx < 0 or tidx < idx:
+                    idx = tidx
+            if idx < 0:
+                result += self.lines[self.pos:]
+                self.pos = len(self.lines)
+                continue
+            result += self.lines[self.pos:idx+1]
+            self.pos = idx+1
+            return result
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if line == "":
+            raise StopIteration
+        return line
+
+    def close(self):
+        if self.file is not None and self.file is not sys.stdin:
+            self.file.close()
+        self.file = None
+
+# Open possibly compressed input.  Empty name or "-" indicates stdin
+def openInput(fname = ""):
+    if fname in ["", "-"]:
+        return LineReader(sys.stdin, fd = sys.stdin.fileno())
+    return LineReader(open(fname, "rb"))
+
+# Pipelined output of simulator frames.
+# The simulator copies node counts into one of a fixed set of buffers and hands it
+# to a writer thread, which formats and writes the frame and then returns the buffer.
+# With two buffers, step t+1 can be computed while frame t is formatted and written,
+# and memory is bounded by the number of buffers.
+class FrameWriter:
+    file = None
+    freeBuffers = None  # Buffers available to simulator
+    pending = None      # Frames and text waiting to be written, in order
+    thread = None
+    error = None
+
+    def __init__(self, f, bufferCount = 2):
+        self.file = f
+        bufferCount = max(bufferCount, 1)
+        self.freeBuffers = Queue.Queue()
+        for i in range(bufferCount):
+            self.freeBuffers.put([])
+        # Text writes don't hold buffers, and so bound them separately
+        self.pending = Queue.Queue(bufferCount + defaultDepth)
+        self.error = None
+        self.thread = threading.Thread(target = self.run, name = "FrameWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            if self.error is not None:
+                if isinstance(item, tuple) and item[2] is not None:
+                    self.freeBuffers.put(item[2])
+                continue
+            try:
+                if isinstance(item, tuple):
+                    (nnode, nrat, buf) = item
+                    lines = ["STEP %d %d\n" % (nnode, nrat)]
+                    if buf is not None:
+                        lines.append("\n".join(map(str, buf)))
+                        lines.append("\n")
+                        self.freeBuffers.put(buf)
+                    lines.append("END\n")
+                    self.file.write("".join(lines))
+                else:
+                    self.file.write(item)
+            except Exception as e:
+                self.error = e
+        try:
+            self.file.flush()
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+
+    def checkError(self):
+        if self.error is not None:
+            e = self.error
+            self.error = None
+            raise IOError("Output failed: %s" % e)
+
+    # Get buffer to fill with counts.  Blocks until writer has finished with one
+    def acquire(self):
+        self.checkError()
+        return self.freeBuffers.get()
+
+    # Queue frame.  buf is None when counts omitted from frame
+    def putFrame(self, nnode, nrat, buf = None):
+        self.checkError()
+        self.pending.put((nnode, nrat, buf))
+
+    def write(self, data):
+        self.checkError()
+        self.pending.put(data)
+
+    def flush(self):
+        self.checkError()
+
+    # Wait for all frames to be written.  Doesn't close underlying file
+    def close(self):
+        if self.thread is None:
+            return
+        self.pending.put(None)
+        self.thread.join()
+        self.thread = None
+        self.checkError()
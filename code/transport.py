@@ -0,0 +1,188 @@
+#!/usr/bin/python
+
+# Socket transport between simulators and a visualizer operating in driven mode.
+# The visualizer listens on a local TCP port or Unix domain socket.
+# Simulators connect to it, and can run whether or not a visualizer is attached:
+# While connected, output is sent with blocking writes, so that a slow visualizer
+# paces the simulator.  While disconnected, frames are dropped, and the connection
+# is retried periodically.
+#
+# When run as a program, relays driver output from stdin to a visualizer, e.g.:
+#   linux> ./crun -g GFILE -r RFILE -n 1000 | ./transport.py 5418
+#   linux> ./grun.py -d -L 5418
+
+import sys
+import os
+import socket
+import select
+import errno
+import time
+import getopt
+
+import streamio
+
+def usage(name):
+    print "Usage: %s [-h] [-r SECS] ADDR" % name
+    print "    -h       Print this message"
+    print "    -r SECS  Interval between attempts to connect to visualizer (default = %.1f)" % retryInterval
+    print "    ADDR     Visualizer address: PORT, HOST:PORT, or unix:PATH"
+    sys.exit(0)
+
+# Seconds between connection attempts by disconnected simulator
+retryInterval = 1.0
+# Seconds between checks for connections by waiting visualizer
+pollInterval = 0.1
+
+# Parse address.  Returns (family, socket address)
+def parseAddress(addr):
+    if addr.startswith("unix:"):
+        return (socket.AF_UNIX, addr[len("unix:"):])
+    if ":" in addr:
+        host, port = addr.rsplit(":", 1)
+        return (socket.AF_INET, (host if host != "" else "localhost", int(port)))
+    return (socket.AF_INET, ("localhost", int(addr)))
+
+# Listening end, used by visualizer.  Accepts one simulator at a time
+class Listener:
+    address = ""
+    family = socket.AF_INET
+    sock = None
+    conn = None
+
+    def __init__(self, addr):
+        self.address = addr
+        self.family, saddr = parseAddress(addr)
+        self.sock = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_UNIX:
+            # Remove socket file left by earlier run
+            if os.path.exists(saddr):
+                os.remove(saddr)
+        else:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(saddr)
+        self.sock.listen(1)
+        self.conn = None
+
+    # Wait for simulator to connect, calling idle periodically while waiting.
+    # Returns line reader for data from simulator
+    def accept(self, idle = None):
+        self.disconnect()
+        sys.stderr.write("Waiting for simulator at %s\n" % self.address)
+        while True:
+            ready, w, x = select.select([self.sock], [], [], pollInterval)
+            if len(ready) > 0:
+                break
+            if idle is not None:
+                idle()
+        self.conn, peer = self.sock.accept()
+        sys.stderr.write("Simulator connected\n")
+        return streamio.LineReader(None, fd = self.conn.fileno())
+
+    def disconnect(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def close(self):
+        self.disconnect()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            if self.family == socket.AF_UNIX:
+                path = parseAddress(self.address)[1]
+                if os.path.exists(path):
+                    os.remove(path)
+
+# Connecting end, used by simulator.  File-like object accepting writes of complete frames.
+# Writes made while not connected are dropped
+class SocketSink:
+    address = ""
+    sock = None
+    lastAttempt = None
+    dropped = 0
+
+    def __init__(self, addr):
+        self.address = addr
+        self.sock = None
+        self.lastAttempt = None
+        self.dropped = 0
+        self.connect()
+
+    def connect(self):
+        self.lastAttempt = time.time()
+        family, saddr = parseAddress(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.connect(saddr)
+        except socket.error:
+            sock.close()
+            return False
+        self.sock = sock
+        sys.stderr.write("Connected to visualizer at %s\n" % self.address)
+        return True
+
+    def connected(self):
+        if self.sock is not None:
+            return True
+        if time.time() - self.lastAttempt < retryInterval:
+            return False
+        return self.connect()
+
+    def disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            self.lastAttempt = time.time()
+            sys.stderr.write("Visualizer at %s disconnected\n" % self.address)
+
+    def write(self, data):
+        if not self.connected():
+            self.dropped += 1
+            return
+        try:
+            self.sock.sendall(data)
+        except socket.error as e:
+            if e.errno not in [errno.EPIPE, errno.ECONNRESET]:
+                raise
+            self.disconnect()
+            self.dropped += 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_WR)
+            except socket.error:
+                pass
+            self.sock.close()
+            self.sock = None
+
+# Copy driver output from stdin to visualizer, one frame at a time
+def relay(addr):
+    sink = SocketSink(addr)
+    frame = []
+    for line in streamio.openInput():
+        frame.append(line)
+        if line.startswith("END") or line.startswith("DONE"):
+            sink.write("".join(frame))
+            frame = []
+    sink.close()
+    if sink.dropped > 0:
+        sys.stderr.write("%d frames not delivered to visualizer\n" % sink.dropped)
+
+def run(name, args):
+    global retryInterval
+    optlist, args = getopt.getopt(args, "hr:")
+    for (opt, val) in optlist:
+        if opt == '-h':
+            usage(name)
+        elif opt == '-r':
+            retryInterval = float(val)
+    if len(args) != 1:
+        usage(name)
+    relay(args[0])
+
+if __name__ == "__main__":
+    run(sys.argv[0], sys.argv[1:])
@@ -42,6 +42,18 @@ class VizMode:
     def doASCII(self, v):
         return v in [self.ascii, self.both]
 
+# How counts of nodes covered by a heatmap tile are combined
+class Pooling:
+    sum, max, error = range(3)
+
+    def parse(self, name):
+        if name == 's':
+            return self.sum
+        elif name == 'm':
+            return self.max
+        else:
+            return self.error
+
 class Formatter:
 
     k = 0
@@ -54,7 +66,7 @@ class Formatter:
     tlast = None
     display = None
 
-    def __init__(self, k, maxval, fname = "", viz = VizMode.both):
+    def __init__(self, k, maxval, fname = "", viz = VizMode.both, pooling = Pooling.sum):
         self.k = k
         self.digits = int(math.ceil(math.log10(maxval+1)))
         # Pattern that separates lines
@@ -79,7 +91,7 @@ class Formatter:
             curses.cbreak()
         self.tlast = datetime.datetime.now()
         if vm.doHeatMap(viz):
-            self.display = Display(k = self.k, maxval = maxval)
+            self.display = Display(k = self.k, maxval = maxval, pooling = pooling)
         self.reset()
 
     def reset(self):
@@ -217,49 +229,137 @@ class HeatMap:
         clist = [self.genColor(v) for v in vlist]
         return clist
 
+# Combine counts of k x k grid into tiles x tiles grid of tile values,
+# covering span x span region with upper left corner at (r0, c0).
+# Each tile covers a band of rows and a band of columns of the region.
+# When span isn't a multiple of tiles, bands differ in width by one node,
+# and so sums are scaled to the mean tile area to avoid banding in the image
+def poolCounts(vlist, k, r0, c0, span, tiles, pooling = Pooling.sum):
+    bounds = [(i * span) / tiles for i in range(tiles+1)]
+    meanArea = float(span * span) / (tiles * tiles)
+    result = []
+    for tr in range(tiles):
+        rows = range(r0 + bounds[tr], r0 + bounds[tr+1])
+        for tc in range(tiles):
+            clo = c0 + bounds[tc]
+            chi = c0 + bounds[tc+1]
+            if pooling == Pooling.max:
+                result.append(max([max(vlist[r*k+clo:r*k+chi]) for r in rows]))
+            else:
+                total = sum([sum(vlist[r*k+clo:r*k+chi]) for r in rows])
+                area = len(rows) * (chi - clo)
+                result.append(total if area == meanArea else total * meanArea / area)
+    return result
+
+# Heatmap window.  When the graph has more nodes per side than the window can show
+# at minSquareSize pixels each, nodes are pooled into tiles, so that rendering cost
+# depends on window size rather than graph size.
+# Keys: '+' or left click zooms in (centered on click), '-' or right click zooms out,
+# arrows pan, '0' shows whole graph.  Zooming far enough shows individual nodes
 class Display:
     k = 10
     squareSize = 8
+    minSquareSize = 4
+    side = 800      # Width and height of canvas, in pixels
     display = None  # TK Window
     frame = None    # Frame within window
     canvas = None   # Canvas within frame
-    squares = []    # Set of rectangles, k*k total
-    colorList = []  # Most recent set of colors
+    squares = []    # Set of rectangles, tiles*tiles total
+    colorList = []  # Most recent set of colors, one per tile
     hmap = None
-
-    def __init__(self, k = 10,  maxdim = 800, maxval = 100):
+    pooling = Pooling.sum
+    tiles = 10      # Number of tiles along each side of view
+    span = 10       # Number of nodes along each side of view
+    r0 = 0          # Row and column of upper left node of view
+    c0 = 0
+    vlist = None    # Most recent counts
+    maxval = 100
+
+    def __init__(self, k = 10,  maxdim = 800, maxval = 100, pooling = Pooling.sum):
         importSpecial()
         self.k = k
+        self.maxval = maxval
+        self.pooling = pooling
         nodeCount = k * k
         loadFactor = maxval / nodeCount
-        self.squareSize = maxdim / self.k
+        self.squareSize = max(maxdim / self.k, self.minSquareSize)
+        self.side = min(self.k * self.squareSize, maxdim)
         self.display = Tkinter.Tk()
         self.display.title('GraphRat Simulation of %d X %d maze (load factor = %d)' % (k, k, loadFactor))
         self.frame = Tkinter.Frame(self.display)
         self.frame.pack(fill=Tkinter.BOTH)
-        self.canvas = Tkinter.Canvas(self.frame, width = k * self.squareSize, height = k * self.squareSize)
+        self.canvas = Tkinter.Canvas(self.frame, width = self.side, height = self.side)
         self.canvas.pack(fill=Tkinter.BOTH)
         self.squares = []
-        for r in range(0, self.k):
-            for c in range(0, self.k):
-                (x, y) = self.xyPos(r, c)
-                sq = self.canvas.create_rectangle(x, y, x+self.squareSize, y+self.squareSize, width = 0,
-                                                  fill = cstring(Colors.black))
-                self.squares.append(sq)
-        self.hmap = HeatMap(maxval = maxval, avgval = maxval/nodeCount)
+        self.colorList = []
+        self.vlist = None
+        self.setView(0, 0, self.k)
+        for key in ["<plus>", "<equal>", "<KP_Add>"]:
+            self.display.bind(key, lambda e: self.zoom(0.5))
+        for key in ["<minus>", "<KP_Subtract>"]:
+            self.display.bind(key, lambda e: self.zoom(2.0))
+        self.display.bind("<Left>", lambda e: self.pan(0, -1))
+        self.display.bind("<Right>", lambda e: self.pan(0, 1))
+        self.display.bind("<Up>", lambda e: self.pan(-1, 0))
+        self.display.bind("<Down>", lambda e: self.pan(1, 0))
+        self.display.bind("<Key-0>", lambda e: self.setView(0, 0, self.k))
+        self.canvas.bind("<Button-1>", lambda e: self.zoom(0.5, e.x, e.y))
+        self.canvas.bind("<Button-3>", lambda e: self.zoom(2.0, e.x, e.y))
         self.update()
 
     def update(self):
         self.canvas.update()
 
+    # Show span x span nodes, starting at (r0, c0).  Rebuilds rectangles when number of tiles changes
+    def setView(self, r0, c0, span):
+        span = max(1, min(span, self.k))
+        self.span = span
+        self.r0 = max(0, min(r0, self.k - span))
+        self.c0 = max(0, min(c0, self.k - span))
+        tiles = min(span, self.side / self.minSquareSize)
+        if tiles != self.tiles or len(self.squares) != tiles * tiles:
+            self.tiles = tiles
+            for sq in self.squares:
+                self.canvas.delete(sq)
+            self.squares = []
+            for r in range(0, tiles):
+                for c in range(0, tiles):
+                    (x, y) = self.xyPos(r, c)
+                    (nx, ny) = self.xyPos(r+1, c+1)
+                    sq = self.canvas.create_rectangle(x, y, nx, ny, width = 0,
+                                                      fill = cstring(Colors.black))
+                    self.squares.append(sq)
+            self.colorList = [cstring(Colors.black)] * (tiles * tiles)
+        # Sum pooling scales counts by number of nodes per tile
+        nodeCount = self.k * self.k
+        perTile = (span * span) / (tiles * tiles) if self.pooling == Pooling.sum else 1
+        self.hmap = HeatMap(maxval = self.maxval, avgval = perTile * self.maxval / nodeCount)
+        if self.vlist is not None:
+            self.setColors(self.vlist)
+
+    # Scale view by factor, keeping node at pixel (x, y) (default = center) at same relative position
+    def zoom(self, factor, x = None, y = None):
+        if x is None or y is None:
+            x = y = self.side / 2
+        r = self.r0 + (y * self.span) / self.side
+        c = self.c0 + (x * self.span) / self.side
+        span = max(1, int(self.span * factor))
+        self.setView(r - (y * span) / self.side, c - (x * span) / self.side, span)
+
+    # Move view by quarter of its width in given direction
+    def pan(self, dr, dc):
+        step = max(1, self.span / 4)
+        self.setView(self.r0 + dr * step, self.c0 + dc * step, self.span)
+
+    # Pixel position of upper left corner of tile
     def xyPos(self, r, c):
-        x = self.squareSize * c
-        y = self.squareSize * r
+        x = (self.side * c) / self.tiles
+        y = (self.side * r) / self.tiles
         return (x, y)
 
     def rowCol(self, idx):
-        r = idx / self.k
-        c = idx % self.k
+        r = idx / self.tiles
+        c = idx % self.tiles
         return (r, c)
 
     def colorSquare(self, idx, color):
@@ -267,28 +367,31 @@ class Display:
             square =  self.squares[idx]
             self.canvas.itemconfig(square, fill = color)
 
-    # Set colors based on counts for each square
+    # Set colors based on counts for each node.  Only changed tiles are redrawn
     def setColors(self, vlist = []):
-        clist = self.hmap.genColors(vlist)
+        self.vlist = vlist
+        if len(vlist) != self.k * self.k:
+            return
+        tvals = poolCounts(vlist, self.k, self.r0, self.c0, self.span, self.tiles, self.pooling)
+        clist = self.hmap.genColors(tvals)
+        for idx in range(len(clist)):
+            if clist[idx] != self.colorList[idx]:
+                self.colorSquare(idx, clist[idx])
         self.colorList = clist
-        for idx in range(len(vlist)):
-            self.colorSquare(idx, clist[idx])
         self.update()
             
     def capture(self, fname):
-        img = Image.new('RGB', (self.k * self.squareSize, self.k * self.squareSize), "black")
+        img = Image.new('RGB', (self.side, self.side), "black")
         dimg = ImageDraw.Draw(img)
         for idx in range(len(self.colorList)):
             r, c = self.rowCol(idx)
             x, y = self.xyPos(r, c)
-            dimg.rectangle((x, y, x + self.squareSize, y + self.squareSize), fill = self.colorList[idx])
-            try:
-                img.save(fname)
-            except Exception as e:
-                print "Could not save image to file %s.  %s" % (fname, e)
+            nx, ny = self.xyPos(r+1, c+1)
+            dimg.rectangle((x, y, nx, ny), fill = self.colorList[idx])
+        try:
+            img.save(fname)
+        except Exception as e:
+            print "Could not save image to file %s.  %s" % (fname, e)
 
     def finish(self):
         self.display.destroy()
-
-
-